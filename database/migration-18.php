@@ -0,0 +1,21 @@
+<?php
+
+$migrate = function() {
+    mysql_query("CREATE TABLE IF NOT EXISTS `awfy_dirty_partition` (
+                 `id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+                 `machine_id` int(10) unsigned NOT NULL,
+                 `suite_id` int(10) unsigned NOT NULL,
+                 `run_id` int(10) unsigned NOT NULL,
+                 PRIMARY KEY (`id`)
+                 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;");
+
+    // Mark everything dirty once, so the first update after the migration
+    // doesn't miss runs that finished before the queue existed.
+    mysql_query("INSERT INTO `awfy_dirty_partition` (machine_id, suite_id, run_id)
+                 SELECT awfy_machine.id, awfy_suite.id, 0
+                 FROM awfy_machine, awfy_suite");
+};
+
+$rollback = function() {
+    mysql_query("DROP TABLE `awfy_dirty_partition`");
+};
@@ -0,0 +1,25 @@
+<?php
+
+$migrate = function() {
+    mysql_query("CREATE TABLE IF NOT EXISTS `awfy_machine_suite` (
+                 `machine_id` int(10) unsigned NOT NULL,
+                 `suite_version_id` int(10) unsigned NOT NULL,
+                 `first_seen` int(10) unsigned NOT NULL,
+                 `last_seen` int(10) unsigned NOT NULL,
+                 PRIMARY KEY (`machine_id`, `suite_version_id`)
+                 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;");
+
+    // Summarize the history once. From now on Run::finish keeps it up to date.
+    mysql_query("INSERT INTO `awfy_machine_suite` (machine_id, suite_version_id, first_seen, last_seen)
+                 SELECT awfy_run.machine, awfy_score.suite_version_id,
+                        MIN(awfy_run.approx_stamp), MAX(awfy_run.approx_stamp)
+                 FROM awfy_run
+                 JOIN awfy_build ON awfy_build.run_id = awfy_run.id
+                 JOIN awfy_score ON awfy_score.build_id = awfy_build.id
+                 WHERE awfy_score.suite_version_id IS NOT NULL
+                 GROUP BY awfy_run.machine, awfy_score.suite_version_id");
+};
+
+$rollback = function() {
+    mysql_query("DROP TABLE `awfy_machine_suite`");
+};
@@ -0,0 +1,315 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Incremental state for the aggregated graphs of condenser.py.
+#
+# An aggregate condenses the historical part of all raw months into regions,
+# whose bounds move every time points get added. Instead of loading and
+# combining all months for that, every raw month gets a state file with
+# running sums per line (<prefix>aggstate-<name>-Y-M.bin), which is only
+# rewritten when the month changes. A region is answered from the running
+# sums of the months it starts and ends in, plus the totals of the months in
+# between, so only a few values per month get read.
+#
+#   header:  'AWFYAGG3' direction nslots nlines ncsets   (int32 each)
+#   times    int32[nslots]
+#   modes    int32[nlines]
+#   per line:
+#     total   float64[nslots+1]  sum of the valid scores minus center before
+#                                slot k
+#     count   int32[nslots+1]    number of valid scores before slot k
+#     points  int32[nslots+1]    number of points (valid or not) before slot k
+#     last    int32[nslots+1]    last slot before k with a valid score, or -1
+#     first   int32[nslots+1]    first slot from k on with a valid score and
+#                                a cset, or -1
+#     cset    int32[nslots]      index into csets (-1 for none)
+#     version int32[nslots]      suite_version (-1 for none)
+#     id      int32[nslots]      score id (-1 for none)
+#     score   float64[nslots]    the valid score, or 0
+#     center  float64            mean of the valid scores of the line
+#     squares float64[nslots+1]  sum of (valid score - center) ** 2 before
+#                                slot k
+#     low     float64[nblocks]   lowest valid score of every BlockSize slots,
+#                                or inf
+#     high    float64[nblocks]   highest valid score of every BlockSize slots,
+#                                or -inf
+#   csets:   offsets int32[ncsets+1], followed by the utf-8 bytes
+#
+# Like in condense_graph(), a score is valid when it's there and not zero.
+# The spread of a region comes from the same running sums. Its lowest and
+# highest score come from the blocks it covers, plus the slots of at most two
+# partial blocks per month. The median can't be had that way, so the regions
+# of an aggregate don't have one.
+#
+# A state gets rebuilt when the generation of its raw month changed (see
+# manifest.py).
+
+import os
+import mmap
+import struct
+import catalog
+import util
+import partition
+import rawstore
+import manifest
+
+Magic = b'AWFYAGG3'
+Header = struct.Struct('<8siiii')
+Int = struct.Struct('<i')
+Double = struct.Struct('<d')
+
+BlockSize = 64
+
+def block_count(nslots):
+    return (nslots + BlockSize - 1) // BlockSize
+
+def state_name(prefix, name, when):
+    return prefix + 'aggstate-' + name + partition.month_suffix(when) + '.bin'
+
+def build(graph):
+    """Serializes the state of a raw month graph."""
+    nslots = len(graph['timelist'])
+    csets = []
+    cset_index = { }
+
+    def index_of(cset):
+        if cset is None:
+            return -1
+        if cset not in cset_index:
+            cset_index[cset] = len(csets)
+            csets.append(cset)
+        return cset_index[cset]
+
+    body = [util.pack_array('i', graph['timelist']),
+            util.pack_array('i', [int(line['modeid']) for line in graph['lines']])]
+    for line in graph['lines']:
+        # Scores are summed up minus the mean of the month, which keeps the
+        # running sums small enough for their differences to be accurate.
+        valid_scores = [p[0] for p in line['data'] if p and p[0]]
+        center = sum(valid_scores) / len(valid_scores) if valid_scores else 0.0
+
+        total, count, points, last, squares = [0.0], [0], [0], [-1], [0.0]
+        cset, version, id, score = [], [], [], []
+        low = [float('inf')] * block_count(nslots)
+        high = [float('-inf')] * block_count(nslots)
+        valid = []
+        for slot, p in enumerate(line['data']):
+            points.append(points[-1] + (1 if p else 0))
+            if p and p[0]:
+                total.append(total[-1] + (p[0] - center))
+                squares.append(squares[-1] + (p[0] - center) ** 2)
+                block = slot // BlockSize
+                low[block] = min(low[block], p[0])
+                high[block] = max(high[block], p[0])
+                count.append(count[-1] + 1)
+                last.append(slot)
+                cset.append(index_of(p[1]))
+                version.append(-1 if p[3] is None else int(p[3]))
+                id.append(-1 if p[4] is None else int(p[4]))
+                score.append(p[0])
+                valid.append(bool(p[1]))
+            else:
+                total.append(total[-1])
+                squares.append(squares[-1])
+                count.append(count[-1])
+                last.append(last[-1])
+                cset.append(-1)
+                version.append(-1)
+                id.append(-1)
+                score.append(0.0)
+                valid.append(False)
+
+        first = [-1] * (nslots + 1)
+        for slot in range(nslots - 1, -1, -1):
+            first[slot] = slot if valid[slot] else first[slot + 1]
+
+        body.append(util.pack_array('d', total))
+        for column in [count, points, last, first, cset, version, id]:
+            body.append(util.pack_array('i', column))
+        for column in [score, [center], squares, low, high]:
+            body.append(util.pack_array('d', column))
+
+    encoded = [text.encode('utf-8') for text in csets]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    body.append(util.pack_array('i', offsets))
+    body.extend(encoded)
+
+    header = Header.pack(Magic, graph['direction'] or 0, nslots, len(graph['lines']), len(csets))
+    return header + b''.join(body)
+
+class MonthState(object):
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        self.buf = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.direction, self.nslots, nlines, ncsets = Header.unpack_from(self.buf, 0)
+        if magic != Magic:
+            raise Exception('corrupt aggregate state ' + path)
+
+        n = self.nslots
+        pos = Header.size
+        self.times_at = pos
+        pos += 4 * n
+        self.modes = list(util.unpack_array('i', self.buf[pos:pos + 4 * nlines]))
+        pos += 4 * nlines
+
+        self.nblocks = block_count(n)
+        self.lines = { }
+        for modeid in self.modes:
+            self.lines[modeid] = pos
+            pos += 8 * (n + 1) + 16 * (n + 1) + 12 * n + 8 * n + 8 + 8 * (n + 1) + 16 * self.nblocks
+        self.csets_at = pos
+        self.cset_data_at = pos + 4 * (ncsets + 1)
+
+    def close(self):
+        self.buf.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _int(self, pos):
+        return Int.unpack_from(self.buf, pos)[0]
+
+    def _column(self, modeid, column, slot):
+        n = self.nslots
+        pos = self.lines[modeid]
+        if column == 'total':
+            return Double.unpack_from(self.buf, pos + 8 * slot)[0]
+        pos += 8 * (n + 1)
+        for name in ['count', 'points', 'last', 'first']:
+            if column == name:
+                return self._int(pos + 4 * slot)
+            pos += 4 * (n + 1)
+        for name in ['cset', 'version', 'id']:
+            if column == name:
+                return self._int(pos + 4 * slot)
+            pos += 4 * n
+        raise Exception('unknown column ' + column)
+
+    def _doubles(self, pos, start, end):
+        return util.unpack_array('d', self.buf[pos + 8 * start:pos + 8 * end])
+
+    def scores(self, modeid, start, end):
+        """Returns the valid scores of the slots [start, end) of a line."""
+        n = self.nslots
+        pos = self.lines[modeid] + 8 * (n + 1) + 16 * (n + 1) + 12 * n
+        return [score for score in self._doubles(pos, start, end) if score]
+
+    def time(self, slot):
+        return self._int(self.times_at + 4 * slot)
+
+    def cset(self, index):
+        if index < 0:
+            return None
+        start = self._int(self.csets_at + 4 * index)
+        end = self._int(self.csets_at + 4 * (index + 1))
+        return self.buf[self.cset_data_at + start:self.cset_data_at + end].decode('utf-8')
+
+    def points_before(self, modeid, slot):
+        return self._column(modeid, 'points', slot)
+
+    def center(self, modeid):
+        n = self.nslots
+        pos = self.lines[modeid] + 8 * (n + 1) + 16 * (n + 1) + 12 * n + 8 * n
+        return Double.unpack_from(self.buf, pos)[0]
+
+    def spread(self, modeid, start, end):
+        """Returns the sum of the squared deviations of the valid scores of
+        the slots [start, end) of a line from their mean, and the lowest and
+        highest of them (None when there are none)."""
+        n = self.nslots
+        pos = self.lines[modeid] + 8 * (n + 1) + 16 * (n + 1) + 12 * n + 8 * n + 8
+        squares = self._doubles(pos, end, end + 1)[0] - self._doubles(pos, start, start + 1)[0]
+        count = self._column(modeid, 'count', end) - self._column(modeid, 'count', start)
+        if count:
+            total = self._column(modeid, 'total', end) - self._column(modeid, 'total', start)
+            squares = max(squares - total * total / count, 0.0)
+
+        # Whole blocks come from the block columns, the slots of the partial
+        # blocks at either end are read one by one.
+        begin = (start + BlockSize - 1) // BlockSize
+        stop = end // BlockSize
+        if begin >= stop:
+            values = self.scores(modeid, start, end)
+            lows = highs = values
+        else:
+            values = self.scores(modeid, start, begin * BlockSize) + \
+                     self.scores(modeid, stop * BlockSize, end)
+            pos += 8 * (n + 1)
+            lows = list(self._doubles(pos, begin, stop)) + values
+            pos += 8 * self.nblocks
+            highs = list(self._doubles(pos, begin, stop)) + values
+        low = min(lows) if len(lows) else float('inf')
+        high = max(highs) if len(highs) else float('-inf')
+        if low == float('inf'):
+            return squares, None, None
+        return squares, low, high
+
+    def summarize(self, modeid, start, end):
+        """Summarizes the slots [start, end) of a line: returns the sum and
+        number of the valid scores, the first cset of them and the
+        (cset, suite_version, id) of the last one."""
+        count = self._column(modeid, 'count', end) - self._column(modeid, 'count', start)
+        total = self._column(modeid, 'total', end) - self._column(modeid, 'total', start)
+        total += count * self.center(modeid)
+
+        first = None
+        slot = self._column(modeid, 'first', start)
+        if slot >= 0 and slot < end:
+            first = self.cset(self._column(modeid, 'cset', slot))
+
+        last = None
+        slot = self._column(modeid, 'last', end)
+        if slot >= start:
+            version = self._column(modeid, 'version', slot)
+            id = self._column(modeid, 'id', slot)
+            last = (self.cset(self._column(modeid, 'cset', slot)),
+                    version if version >= 0 else None,
+                    id if id >= 0 else None)
+        return total, count, first, last
+
+def current_format(path):
+    with open(path, 'rb') as fp:
+        return fp.read(len(Magic)) == Magic
+
+def update(prefix, name, files, generation):
+    """Brings the state files of the given raw months (as returned by
+    find_all_months) up to date and returns their paths. |generation| gives
+    the generation of a raw month. States of months which are gone get
+    removed."""
+    wanted = set()
+    paths = []
+    built = manifest.Outputs(prefix + 'aggstate-' + name)
+    try:
+        for when, raw_file in files:
+            state_file = state_name(prefix, name, when)
+            wanted.add(state_file)
+
+            path = catalog.path_of(state_file)
+            if not os.path.exists(path) or not built.current(when, generation(when)) or \
+               not current_format(path):
+                graph = rawstore.retrieve_month(raw_file)
+                with open(path + '.tmp', 'wb') as fp:
+                    fp.write(build(graph))
+                os.rename(path + '.tmp', path)
+                catalog.added(state_file)
+                built.record(when, generation(when))
+
+            paths.append(path)
+    finally:
+        built.prune(files)
+        built.save()
+
+    for when, state_file in catalog.get().months('aggstate', prefix, name, 'bin'):
+        if state_file not in wanted:
+            os.remove(catalog.path_of(state_file))
+            catalog.removed(state_file)
+
+    return paths
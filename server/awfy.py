@@ -5,20 +5,37 @@
 
 try:
   import MySQLdb as mdb
+  import MySQLdb.cursors as mdb_cursors
 except:
   import mysqldb as mdb
+  import mysqldb.cursors as mdb_cursors
 try:
   import ConfigParser
 except:
   import configparser as ConfigParser
 
 db = None
+replica = None
+replica_lag = 0
 version = None
 path = None
 th_host = None
 th_user = None
 th_secret = None
+update_workers = 1
+shard_data = False
+lazy_subtests = False
+row_cache_size = 16
 
+# MySQL errors after which the connection is gone: "server has gone away"
+# and "lost connection to server during query".
+ConnectionLost = (2006, 2013)
+
+# Number of times a read gets retried on a new connection.
+ReadRetries = 2
+
+# Spare connections kept around for streaming cursors.
+PoolSize = 4
 
 queries = 0
 class DB:
@@ -27,35 +44,159 @@ class DB:
     self.user = user
     self.pw = pw
     self.name = name
-    self.connect()
-  def connect(self):
+    # Regular cursors and commits use self.db, which gets connected on first
+    # use. Streaming cursors get a connection of their own out of the pool.
+    self.db = None
+    self.pool = []
+  def open(self):
     if self.host[0] == '/':
-      self.db = mdb.connect(unix_socket=self.host, user=self.user, passwd=self.pw,
-                            db=self.name, use_unicode=True)
+      return mdb.connect(unix_socket=self.host, user=self.user, passwd=self.pw,
+                         db=self.name, use_unicode=True)
+    return mdb.connect(self.host, self.user, self.pw, self.name, use_unicode=True)
+  def connect(self):
+    self.close()
+    self.db = self.open()
+  def connection(self):
+    if self.db is None:
+      self.db = self.open()
+    return self.db
+  def close(self):
+    for conn in [self.db] + self.pool:
+      if conn is None:
+        continue
+      try:
+        conn.close()
+      except:
+        pass
+    self.db = None
+    self.pool = []
+  def cursor(self, streaming=False):
+    # A streaming cursor keeps the result set on the server and hands out the
+    # rows while iterating. No other query can run on its connection until
+    # all rows are consumed, so it gets a connection from the pool, which
+    # goes back once the cursor is done.
+    if streaming:
+      if len(self.pool):
+        conn = self.pool.pop()
+      else:
+        conn = self.open()
+      return DBCursor(self, conn, True)
+    return DBCursor(self, self.connection(), False)
+  def release(self, conn):
+    try:
+      # End the transaction, else the next query would read an old snapshot.
+      conn.rollback()
+    except:
+      return
+    if len(self.pool) < PoolSize:
+      self.pool.append(conn)
     else:
-      self.db = mdb.connect(self.host, self.user, self.pw, self.name, use_unicode=True)
-  def cursor(self):
-    return DBCursor(self.db.cursor())
+      conn.close()
   def commit(self):
-    return self.db.commit()
+    return self.connection().commit()
 class DBCursor:
-  def __init__(self, cursor):
-    self.cursor = cursor
+  def __init__(self, db, conn, streaming):
+    self.db = db
+    self.conn = conn
+    self.streaming = streaming
+    self.cursor = self.new_cursor()
+  def new_cursor(self):
+    if self.streaming:
+      return self.conn.cursor(mdb_cursors.SSCursor)
+    return self.conn.cursor()
+  def reconnect(self):
+    try:
+      self.conn.close()
+    except:
+      pass
+    self.conn = self.db.open()
+    if not self.streaming:
+      self.db.db = self.conn
+    self.cursor = self.new_cursor()
   def execute(self, sql, data=None):
     global queries
     queries+=1
-    exe = self.cursor.execute(sql, data);
+    # Reads get retried on a new connection when the old one got dropped.
+    # Anything else only reconnects, so the next statement works again.
+    retries = ReadRetries if sql.lstrip()[:6].upper() == "SELECT" else 0
+    while True:
+      try:
+        exe = self.cursor.execute(sql, data);
+        break
+      except mdb.OperationalError as e:
+        if e.args[0] not in ConnectionLost:
+          raise
+        self.reconnect()
+        if not retries:
+          raise
+        retries -= 1
     self.description = self.cursor.description
     self.lastrowid = self.cursor.lastrowid
     self.rowcount = self.cursor.rowcount
     return exe
+  def executemany(self, sql, data):
+    global queries
+    queries+=1
+    try:
+      exe = self.cursor.executemany(sql, data);
+    except mdb.OperationalError as e:
+      if e.args[0] in ConnectionLost:
+        self.reconnect()
+      raise
+    self.rowcount = self.cursor.rowcount
+    return exe
   def fetchone(self):
     return self.cursor.fetchone();
   def fetchall(self):
     return self.cursor.fetchall();
+  def fetchmany(self, size):
+    return self.cursor.fetchmany(size);
+  def close(self):
+    exe = self.cursor.close();
+    self.release()
+    return exe
+  def release(self):
+    if self.streaming and self.conn is not None:
+      conn = self.conn
+      self.conn = None
+      self.db.release(conn)
+  def __iter__(self):
+    while True:
+      rows = self.cursor.fetchmany(1000)
+      if not rows:
+        break
+      for row in rows:
+        yield row
+
+def LoadVersion():
+    c = db.cursor()
+    c.execute("SELECT `value` FROM awfy_config WHERE `key` = 'version'")
+    row = c.fetchone()
+    return int(row[0])
+
+def Version():
+    global version
+    if version is None:
+        version = LoadVersion()
+    return version
+
+def Reader():
+    """The database for the heavy reads: the replica if there is one."""
+    if replica is not None:
+        return replica
+    return db
 
+def Disconnect():
+    # Connections don't survive a fork, every process opens its own.
+    db.close()
+    if replica is not None:
+        replica.close()
+
+# Only reads the config. The database gets connected on first use and the
+# version loaded on the first call to Version().
 def Startup():
-    global db, version, path, th_host, th_user, th_secret
+    global db, replica, replica_lag, version, path, th_host, th_user, th_secret, \
+           update_workers, shard_data, lazy_subtests, row_cache_size
     config = ConfigParser.RawConfigParser()
     config.read("/etc/awfy-server.config")
 
@@ -65,12 +206,28 @@ def Startup():
     name = config.get('mysql', 'db_name')
 
     db = DB(host, user, pw, name)
-    c = db.cursor()
-    c.execute("SELECT `value` FROM awfy_config WHERE `key` = 'version'")
-    row = c.fetchone()
-    version = int(row[0])
+    version = None
+
+    # Rows of the score queries can be read from a replica. Runs that
+    # finished within |lag| seconds may not be there yet, so update.py
+    # leaves those for the next cycle.
+    if config.has_section('mysql_replica'):
+        replica = DB(config.get('mysql_replica', 'host'),
+                     config.get('mysql_replica', 'user'),
+                     config.get('mysql_replica', 'pass'),
+                     config.get('mysql_replica', 'db_name'))
+        if config.has_option('mysql_replica', 'lag'):
+            replica_lag = config.getint('mysql_replica', 'lag')
 
     path = config.get('general', 'data_folder')
+    if config.has_option('general', 'update_workers'):
+        update_workers = config.getint('general', 'update_workers')
+    if config.has_option('general', 'shard_data'):
+        shard_data = config.getboolean('general', 'shard_data')
+    if config.has_option('general', 'lazy_subtests'):
+        lazy_subtests = config.getboolean('general', 'lazy_subtests')
+    if config.has_option('general', 'row_cache_size'):
+        row_cache_size = config.getint('general', 'row_cache_size')
 
     if config.has_section('treeherder'):
         th_host = config.get('treeherder', 'host')
@@ -0,0 +1,148 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Times building a month graph out of score rows, the way build_graph() in
+# update.py does, with the columnar builder of builder.py and with the dict
+# per point builder it replaced (kept below as the reference). The rows are
+# synthetic: a few modes, runs that don't report every mode, zero scores, and
+# timestamps shared by several runs. Both outputs are checked to be equal.
+#
+#   python bench_builder.py [--rows 50000] [--modes 4] [--repeat 3]
+
+import sys
+import time
+import random
+from optparse import OptionParser
+import builder
+
+class DictLineBuilder:
+    def __init__(self, mode_id):
+        self.points = []
+        self.mode_id = mode_id
+        self.time_occurence = {}
+
+    def addPoint(self, time, first, last, score, suite_version, id):
+        if not score:
+            return
+
+        point = { 'time': time,
+                  'first': first,
+                  'last': None,
+                  'score': score,
+                  'suite_version': suite_version,
+                  'id': id
+                }
+        self.points.append(point)
+        if time not in self.time_occurence:
+            self.time_occurence[time] = 0
+        self.time_occurence[time] += 1
+
+    def fixup(self, max_occurences):
+        point_map = {}
+        for point in self.points:
+            if point['time'] not in point_map:
+                point_map[point['time']] = []
+            point_map[point['time']].append(point)
+
+        self.points = []
+        for time in sorted(max_occurences.keys()):
+            added = 0
+            if time in point_map:
+                self.points += point_map[time]
+                added = len(point_map[time])
+            self.points += [None] * (max_occurences[time] - added)
+        self.time_occurence = max_occurences
+
+    def output(self):
+        data = []
+        for point in self.points:
+            if not point:
+                data.append(None)
+            else:
+                data.append([point['score'], point['first'], point['last'],
+                             point['suite_version'], point['id']])
+        return { 'modeid': self.mode_id, 'data': data }
+
+class DictGraphBuilder:
+    def __init__(self, direction):
+        self.direction = direction
+        self.lines = []
+
+    def newLine(self, mode_id):
+        line = DictLineBuilder(mode_id)
+        self.lines.append(line)
+        return line
+
+    def fixup(self):
+        max_occurences = {}
+        for line in self.lines:
+            for time in line.time_occurence:
+                max_occurences[time] = max(max_occurences.get(time, 0), line.time_occurence[time])
+        for line in self.lines:
+            line.fixup(max_occurences)
+
+    def output(self):
+        timelist = []
+        if len(self.lines):
+            occurences = self.lines[0].time_occurence
+            for time in sorted(occurences.keys()):
+                timelist += [time] * occurences[time]
+        return { 'direction': self.direction,
+                 'lines': [line.output() for line in self.lines],
+                 'timelist': timelist }
+
+def make_rows(count, modes, seed):
+    # Rows grouped per mode, like build_graph() hands them to the builder:
+    # (time, cset, score, suite_version, id).
+    random.seed(seed)
+    per_mode = dict((mode, []) for mode in range(modes))
+    stamp = 1400000000
+    for id in range(count):
+        if random.random() < 0.9:
+            stamp += random.randint(60, 3600)
+        mode = random.randrange(modes)
+        score = 0.0 if random.random() < 0.02 else random.random() * 1000
+        per_mode[mode].append((stamp, 'cset' + str(stamp // 7), score, random.choice([None, 3, 4]), id))
+    return per_mode
+
+def build(graph_builder, per_mode):
+    graph = graph_builder(1)
+    for mode in per_mode:
+        line = graph.newLine(mode)
+        for row in per_mode[mode]:
+            line.addPoint(row[0], row[1], None, row[2], row[3], row[4])
+    graph.fixup()
+    return graph.output()
+
+def best_time(graph_builder, per_mode, repeat):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        build(graph_builder, per_mode)
+        took = time.time() - begin
+        if best is None or took < best:
+            best = took
+    return best
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--rows", dest="rows", type="int", default=50000)
+    parser.add_option("--modes", dest="modes", type="int", default=4)
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args(argv)
+
+    per_mode = make_rows(options.rows, options.modes, options.seed)
+    same = build(DictGraphBuilder, per_mode) == build(builder.GraphBuilder, per_mode)
+
+    old = best_time(DictGraphBuilder, per_mode, options.repeat)
+    new = best_time(builder.GraphBuilder, per_mode, options.repeat)
+    print('rows: ' + str(options.rows) + ', modes: ' + str(options.modes))
+    print('dict per point: %.1fms' % (old * 1000))
+    print('columnar:       %.1fms (%.2fx)' % (new * 1000, old / new))
+    print('same output: ' + str(same))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
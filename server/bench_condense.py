@@ -0,0 +1,118 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compares condensing a raw month the python way (load the json cache and
+# run condense_graph) with the numpy way (load the columns of the segment and
+# run DenseGraph.condense) on a synthetic month. The month is written into a
+# temporary data folder, in blocks like update.py appends them. Both ways
+# have to give the same output, up to the last bits of the averages and
+# deviations.
+#
+#   python bench_condense.py [--slots 5000] [--modes 24] [--blocks 50]
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+from profiler import Profiler
+import awfy
+import util
+import partition
+import rawstore
+import condenser
+import dense
+
+def make_graph(slots, modes, seed):
+    random.seed(seed)
+    timelist = []
+    stamp = 1400000000
+    for i in range(slots):
+        stamp += random.randint(0, 60 * 10)
+        timelist.append(stamp)
+
+    lines = []
+    for modeid in range(modes):
+        data = []
+        for i in range(slots):
+            r = random.random()
+            if r < 0.2:
+                data.append(None)
+                continue
+            data.append([0.0 if r < 0.25 else random.random() * 1000,
+                         None if r < 0.3 else '' if r < 0.32 else 'cset' + str(i),
+                         None,
+                         random.randint(1, 3),
+                         random.randint(1, 10000000)])
+        lines.append({ 'modeid': modeid,
+                       'data': data })
+
+    return { 'direction': 1,
+             'timelist': timelist,
+             'lines': lines }
+
+def split(graph, blocks):
+    # Chops the graph into pieces, like the updates that built the month.
+    size = max(1, len(graph['timelist']) // blocks)
+    for start in range(0, len(graph['timelist']), size):
+        yield { 'direction': graph['direction'],
+                'timelist': graph['timelist'][start:start + size],
+                'lines': [{ 'modeid': line['modeid'],
+                            'data': line['data'][start:start + size] } for line in graph['lines']] }
+
+def same_graph(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return abs(a - b) <= 1e-9 * max(abs(a), abs(b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return sorted(a.keys()) == sorted(b.keys()) and all(same_graph(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_graph(x, y) for x, y in zip(a, b))
+    return a == b
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--slots", dest="slots", type="int", default=5000)
+    parser.add_option("--modes", dest="modes", type="int", default=24)
+    parser.add_option("--blocks", dest="blocks", type="int", default=50)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args(argv)
+
+    if not dense.numpy:
+        print('numpy is not available')
+        return
+
+    awfy.path = tempfile.mkdtemp()
+    try:
+        name = 'raw-bench-1-2016-1'
+        segment = rawstore.Segment(name)
+        for piece in split(make_graph(options.slots, options.modes, options.seed), options.blocks):
+            segment.append(piece)
+        with open(os.path.join(awfy.path, name + '.json'), 'w') as fp:
+            util.json_dump({ 'graph': segment.graph() }, fp)
+        print('Month with ' + str(options.slots * options.modes) + ' points in ' +
+              str(options.modes) + ' lines')
+
+        with Profiler() as p:
+            graph = condenser.retrieve_graph(None, name + '.json')
+            load_time = p.time()
+            loop = condenser.condense_graph(graph, partition.split_into_days(graph['timelist']))
+            loop_time = p.time()
+
+        with Profiler() as p:
+            graph = dense.DenseGraph.from_segment(segment)
+            dense_load_time = p.time()
+            vectorized = graph.condense(partition.split_into_days(graph.timelist))
+            dense_time = p.time()
+
+        same = same_graph(loop, vectorized)
+        print('json + condense_graph:          load ' + load_time + ', total ' + loop_time)
+        print('segment + DenseGraph.condense:  load ' + dense_load_time + ', total ' + dense_time)
+        print('same output: ' + str(same))
+    finally:
+        shutil.rmtree(awfy.path)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compares the padded and the compact graph format (see graphformat.py) on
+# the exports in a data folder: the size of every kind of export in both
+# formats, and the time it takes to parse them (for the compact format
+# including the decoding). Every graph also gets checked to decode to the
+# exact same graph.
+#
+#   python bench_graphformat.py [--folder /path/to/data] [--repeat 3]
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+from optparse import OptionParser
+import awfy
+import util
+import graphformat
+
+KindPattern = re.compile('^(auth-)?(bk-)?(raw|condensed|aggregate|lod\d+)-')
+
+def kind_of(name):
+    m = KindPattern.match(name)
+    if not m:
+        return None
+    return (m.group(2) or '') + m.group(3)
+
+# Hands util.json_load the text as if it were a file.
+class Text(object):
+    def __init__(self, text):
+        self.text = text
+
+    def read(self):
+        return self.text
+
+def parse_time(text, repeat, decode):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        j = util.json_load(Text(text))
+        if decode:
+            graphformat.expand(j)
+        took = time.time() - begin
+        if best is None or took < best:
+            best = took
+    return best
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--folder", dest="folder", type="string", default=awfy.path,
+                      help="Data folder with the exports.")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    (options, args) = parser.parse_args(argv)
+
+    stats = { }
+    mismatches = 0
+    for path in sorted(glob.glob(os.path.join(options.folder, '*.json'))):
+        kind = kind_of(os.path.basename(path))
+        if not kind:
+            continue
+
+        with open(path) as fp:
+            j = graphformat.expand(util.json_load(fp))
+        plain = util.json_dumps(j)
+        compact = util.json_dumps(graphformat.compact(j))
+        if graphformat.expand(json.loads(compact)) != json.loads(plain):
+            mismatches += 1
+
+        s = stats.setdefault(kind, [0, 0, 0, 0.0, 0.0])
+        s[0] += 1
+        s[1] += len(plain)
+        s[2] += len(compact)
+        s[3] += parse_time(plain, options.repeat, False)
+        s[4] += parse_time(compact, options.repeat, True)
+
+    if not stats:
+        print('No exports found in ' + options.folder)
+        return
+
+    print('%-14s %6s %12s %12s %6s %10s %10s' %
+          ('kind', 'files', 'padded', 'compact', 'ratio', 'parse', 'parse+dec'))
+    total = [0, 0, 0, 0.0, 0.0]
+    for kind in sorted(stats):
+        s = stats[kind]
+        print('%-14s %6d %12d %12d %5.1f%% %9.1fms %9.1fms' %
+              (kind, s[0], s[1], s[2], 100.0 * s[2] / s[1], s[3] * 1000, s[4] * 1000))
+        total = [a + b for a, b in zip(total, s)]
+    print('%-14s %6d %12d %12d %5.1f%% %9.1fms %9.1fms' %
+          ('total', total[0], total[1], total[2], 100.0 * total[2] / total[1],
+           total[3] * 1000, total[4] * 1000))
+    print('graphs that decode differently: ' + str(mismatches))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Replays a synthetic multi-year history through a model of the month caches
+# of update.py: every cycle the finished runs are bucketed per month and
+# appended to the month cache. Like in update_cache, appending fails when the
+# new rows don't start after the time of the last point of the cache, and the
+# month then gets renewed (refetched over its bounds). Runs are started around
+# the clock and every day a few runs are retriggered, so plenty of them sit
+# next to a month boundary.
+#
+# The replay is done with the month bounds of partition.py and with the
+# local-time bounds renew_cache used to compute. A renew over wrong bounds
+# puts rows of the neighbouring month into the cache. Once the last point of
+# a cache belongs to the next month, every row that still arrives for the
+# month itself fails to append and causes another renew. Reported are the
+# renews, how many of them were caused by a row of another month at the end
+# of the cache, and the rows that ended up in the wrong month cache (or in
+# none).
+#
+#   python bench_partition.py [--years 4] [--tz America/Los_Angeles]
+
+import os
+import sys
+import time
+import random
+import datetime
+from optparse import OptionParser
+import partition
+
+CycleSeconds = 60 * 15
+
+def local_month_bounds(when):
+    dt = datetime.datetime(year=when[0], month=when[1], day=1)
+    start = int(time.mktime(dt.timetuple()))
+    after = partition.next_month(when)
+    dt = datetime.datetime(year=after[0], month=after[1], day=1)
+    stop = int(time.mktime(dt.timetuple())) - 1
+    return (start, stop)
+
+def make_history(years, seed):
+    # Runs as (sort_order, approx_stamp, finish_stamp).
+    random.seed(seed)
+    start = partition.month_bounds((2012, 1))[0]
+    end = start + years * 365 * partition.SecondsPerDay
+    runs = []
+    stamp = start
+    while stamp < end:
+        stamp += random.randint(60 * 30, 60 * 60 * 5)
+        runs.append([len(runs), stamp, stamp + random.randint(60 * 20, 60 * 90)])
+
+        # Retrigger a recent run. It takes the place (and approx_stamp) after
+        # the run it follows and finishes a while later.
+        if random.random() < 0.1 and len(runs) > 10:
+            before = runs[-random.randint(2, 10)]
+            runs.append([before[0] + 0.5, before[1], runs[-1][2] + random.randint(60 * 20, 60 * 90)])
+    runs.sort(key=lambda run: run[0])
+    return runs
+
+def replay(runs, bounds):
+    by_finish = sorted(runs, key=lambda run: run[2])
+    caches = { }
+    finished = { }
+    renews = 0
+    neighbour_renews = 0
+    pos = 0
+    now = by_finish[0][2]
+    key = lambda run: (run[0], run[1])
+
+    while pos < len(by_finish):
+        now += CycleSeconds
+        new = []
+        while pos < len(by_finish) and by_finish[pos][2] <= now:
+            new.append(by_finish[pos])
+            finished.setdefault(partition.month_of(by_finish[pos][1]), []).append(by_finish[pos])
+            pos += 1
+        if not new:
+            continue
+        new.sort(key=lambda run: run[0])
+
+        groups = []
+        for run in new:
+            when = partition.month_of(run[1])
+            if not groups or groups[-1][0] != when:
+                groups.append((when, []))
+            groups[-1][1].append(run)
+
+        for when, rows in groups:
+            cache = caches.setdefault(when, [])
+            if cache and rows[0][1] <= cache[-1][1]:
+                # Refetch everything finished within the bounds.
+                renews += 1
+                if partition.month_of(cache[-1][1]) != when:
+                    neighbour_renews += 1
+                start, stop = bounds(when)
+                candidates = []
+                for month in [(when[0] - 1, 12) if when[1] == 1 else (when[0], when[1] - 1),
+                              when, partition.next_month(when)]:
+                    candidates += finished.get(month, [])
+                caches[when] = sorted([key(run) for run in candidates if start <= run[1] <= stop])
+            else:
+                cache.extend([key(run) for run in rows])
+
+    wrong = 0
+    for when, cache in caches.items():
+        expected = set(key(run) for run in runs if partition.month_of(run[1]) == when)
+        wrong += len(expected.symmetric_difference(cache))
+    return renews, neighbour_renews, wrong
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--years", dest="years", type="int", default=4)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    parser.add_option("--tz", dest="tz", type="string", default="America/Los_Angeles",
+                      help="Local timezone used for the old month bounds.")
+    (options, args) = parser.parse_args(argv)
+
+    os.environ['TZ'] = options.tz
+    time.tzset()
+
+    runs = make_history(options.years, options.seed)
+    print('Synthetic history: ' + str(len(runs)) + ' runs over ' + str(options.years) + ' years')
+
+    for name, bounds in [('utc (partition.py)', partition.month_bounds),
+                         ('local time (' + options.tz + ')', local_month_bounds)]:
+        begin = time.time()
+        renews, neighbour_renews, wrong = replay(runs, bounds)
+        took = time.time() - begin
+        print('%-36s renews: %5d  caused by other months: %5d  rows in wrong month: %6d  (%.2fs)' %
+              (name, renews, neighbour_renews, wrong, took))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,118 +1,117 @@
 # vim: set ts=4 sw=4 tw=99 et:
 
-class LineBuilder:
-    def __init__(self, mode_id):
-        self.points = []
+import array
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+
+# Points are kept in parallel columns per line instead of a dict per point:
+# the time and score in arrays, the cset as an index into the csets of the
+# graph (0 being None), the suite_version and id (which can be None) in
+# plain lists.
+class LineBuilder(object):
+    __slots__ = ['graph', 'mode_id', 'times', 'scores', 'csets', 'versions', 'ids', 'data']
+
+    def __init__(self, graph, mode_id):
+        self.graph = graph
         self.mode_id = mode_id
-        self.time_occurence = {} 
+        self.times = array.array('l')
+        self.scores = array.array('d')
+        self.csets = array.array('i')
+        self.versions = []
+        self.ids = []
+        self.data = []
 
     def addPoint(self, time, first, last, score, suite_version, id):
         if not score:
             return
 
-        point = { 'time': time,
-                  'first': first,
-                  'last': None,
-                  'score': score,
-                  'suite_version': suite_version,
-                  'id': id
-                }
-        self.points.append(point)
-        if time not in self.time_occurence:
-            self.time_occurence[time] = 0
-        self.time_occurence[time] += 1
+        self.times.append(time)
+        self.scores.append(score)
+        self.csets.append(self.graph.cset_index(first))
+        self.versions.append(suite_version)
+        self.ids.append(id)
 
     def time_occurences(self):
-        return self.time_occurence
-
-    def fixup(self, max_occurences):
-        # sort the list of points and add 'null' datapoints
-        # for every given occurence of timestamp that isn't
-        # in this list.
-
-        amount_datapoints = sum(max_occurences.values())
-
-        point_map = {}
-        for point in self.points:
-            if point['time'] not in point_map:
-                point_map[point['time']] = []
-            point_map[point['time']].append(point)
-
-        self.points = []
-        for time in sorted(max_occurences.keys()):
-            added = 0
-            if time in point_map:
-                self.points += point_map[time]
-                added = len(point_map[time])
-            self.points += [None] * (max_occurences[time] - added)
-
-        self.time_occurence = max_occurences
-        return
-
-    def _data(self):
-        data = []
-        for point in self.points:
-            if not point:
-                data.append(None)
-            else:
-                data.append([
-                    point['score'],
-                    point['first'],
-                    point['last'],
-                    point['suite_version'],
-                    point['id']
-                ])
-        return data
+        occurences = {}
+        for time in self.times:
+            occurences[time] = occurences.get(time, 0) + 1
+        return occurences
+
+    def fixup(self, slots, nslots):
+        # Put every point in the next free slot of its timestamp, in the
+        # order the points were added. Slots without a point stay null.
+        csets = self.graph.csets
+        free = dict(slots)
+        data = [None] * nslots
+        for time, score, cset, version, id in zip(self.times, self.scores, self.csets,
+                                                  self.versions, self.ids):
+            slot = free[time]
+            free[time] = slot + 1
+            data[slot] = [score, csets[cset], None, version, id]
+        self.data = data
 
     def output(self):
         return {
             'modeid': self.mode_id,
-            'data':  self._data()
+            'data': self.data
         }
 
-class GraphBuilder:
+class GraphBuilder(object):
+    __slots__ = ['direction', 'lines', 'csets', 'cset_indices', 'timelist']
+
     def __init__(self, direction):
         self.direction = direction
         self.lines = []
+        self.csets = [None]
+        self.cset_indices = {}
+        self.timelist = []
 
     def newLine(self, mode_id):
-        line = LineBuilder(mode_id)
+        line = LineBuilder(self, mode_id)
         self.lines.append(line)
-        return line 
-        
+        return line
+
+    def cset_index(self, cset):
+        if cset is None:
+            return 0
+        index = self.cset_indices.get(cset)
+        if index is None:
+            index = len(self.csets)
+            self.cset_indices[cset] = index
+            self.csets.append(cset)
+        return index
+
     def _calculate_max_occurences(self):
         # Returns a dictionary with for every timestamp in
         # all lines the maxium number of times it occurs in one line.
         max_occurences = {}
         for line in self.lines:
-            line_occurences = line.time_occurences()
-            for time in line_occurences:
-                if time not in max_occurences:
-                    max_occurences[time] = 0
-                max_occurences[time] = max(max_occurences[time], line_occurences[time]) 
+            for time, count in line.time_occurences().items():
+                if count > max_occurences.get(time, 0):
+                    max_occurences[time] = count
         return max_occurences
 
-    def _timelist(self):
-        if len(self.lines) == 0:
-            return []    
-
-        # After fixup, all lines have the same time_occurences.
-        # Take the first one to create the timelist.
-        occurences = self.lines[0].time_occurences()
-        timelist = []
-        for time in sorted(occurences.keys()):
-            timelist += [time] * occurences[time]
-        return timelist
-
     def fixup(self):
+        # Merge the timestamps of all lines into one sorted timelist, in
+        # which every timestamp occurs as often as in the line that has it
+        # the most, and align every line against it.
         max_occurences = self._calculate_max_occurences()
+        slots = {}
+        timelist = []
+        for time in sorted(max_occurences):
+            slots[time] = len(timelist)
+            timelist.extend([time] * max_occurences[time])
+        self.timelist = timelist
+
         for line in self.lines:
-            line.fixup(max_occurences)
+            line.fixup(slots, len(timelist))
 
     def output(self):
         # Note: always first call fixup! Very important!
         return {
             'direction': self.direction,
             'lines': [line.output() for line in self.lines],
-            'timelist': self._timelist()
+            'timelist': self.timelist
         }
@@ -0,0 +1,195 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Catalog of the month files in the data folder.
+#
+# Looking up the months of a graph used to glob the data folder, once for
+# every suite and subtest, which is slow with tens of thousands of files.
+# The catalog lists the folder once and indexes the month files
+# (<prefix><kind>-<name>-Y-M.<ext>) on (kind, prefix, name, ext). The
+# condenser, update.py and rawstore.py keep it up to date with the files they
+# write and remove, so the daemon mode of update.py never needs to list the
+# folder again. The worker processes of update.py record what they changed
+# in a journal, which the parent replays into its catalog.
+#
+# With shard_data set in the config, the month files are stored in
+# shards/<xx>/ below the data folder, where xx is the low byte of the crc32
+# of the file name in hex, so no folder gets too big. website/data.php
+# resolves those the same way. Run "python catalog.py --shard" to move the
+# files when turning it on, and "--flatten" when turning it off.
+
+import os
+import re
+import sys
+import zlib
+import errno
+from optparse import OptionParser
+import awfy
+
+MonthPattern = re.compile('^((?:auth-)?(?:bk-)?)(raw|condensed|aggstate|lod\d+)-(.+)-(\d\d\d\d)-(\d+)\.(json|bin|seg)$')
+
+def shard_of(file):
+    return '%02x' % (zlib.crc32(file.encode('utf-8')) & 0xff)
+
+def is_month_file(file):
+    return MonthPattern.match(file) is not None
+
+def shard_folder(file):
+    """The shard of a month file, which gets created when it's not there."""
+    folder = os.path.join(awfy.path, 'shards', shard_of(file))
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError as e:
+            # Another worker was first.
+            if e.errno != errno.EEXIST:
+                raise
+    return folder
+
+def path_of(file):
+    """The path of a file in the data folder."""
+    if awfy.shard_data and is_month_file(file):
+        return os.path.join(shard_folder(file), file)
+    return os.path.join(awfy.path, file)
+
+def list_folder():
+    """Lists the month files in the data folder and its shards."""
+    files = [file for file in os.listdir(awfy.path) if is_month_file(file)]
+    shards = os.path.join(awfy.path, 'shards')
+    if os.path.isdir(shards):
+        for shard in os.listdir(shards):
+            folder = os.path.join(shards, shard)
+            if os.path.isdir(folder):
+                files.extend(file for file in os.listdir(folder) if is_month_file(file))
+    return files
+
+class Catalog(object):
+    def __init__(self, files):
+        self.entries = { }
+        # The kinds of month files every (prefix, name, ext) has.
+        self.kinds = { }
+        for file in files:
+            self.add(file)
+
+    def add(self, file):
+        m = MonthPattern.match(file)
+        if not m:
+            return
+        key = (m.group(2), m.group(1), m.group(3), m.group(6))
+        when = (int(m.group(4)), int(m.group(5)))
+        self.entries.setdefault(key, { })[when] = file
+        self.kinds.setdefault(key[1:], set()).add(key[0])
+
+    def remove(self, file):
+        m = MonthPattern.match(file)
+        if not m:
+            return
+        key = (m.group(2), m.group(1), m.group(3), m.group(6))
+        when = (int(m.group(4)), int(m.group(5)))
+        months = self.entries.get(key, { })
+        if months.get(when) == file:
+            del months[when]
+        if key in self.entries and not months:
+            del self.entries[key]
+            kinds = self.kinds[key[1:]]
+            kinds.discard(key[0])
+            if not kinds:
+                del self.kinds[key[1:]]
+
+    def months(self, kind, prefix, name, ext = 'json'):
+        """Returns the (when, file) pairs of a graph, sorted on the month."""
+        months = self.entries.get((kind, prefix, name, ext), { })
+        return sorted(months.items())
+
+    def graphs(self, kind, ext = 'json'):
+        """Returns the (prefix, name) of every graph with month files of the
+        given kind."""
+        return [key[1:3] for key, months in self.entries.items()
+                if key[0] == kind and key[3] == ext and months]
+
+    def files(self, prefix, name, ext = 'json'):
+        """Returns the (kind, when, file) of every month file of a graph."""
+        result = []
+        for kind in self.kinds.get((prefix, name, ext), ()):
+            months = self.entries[(kind, prefix, name, ext)]
+            result.extend((kind, when, file) for when, file in months.items())
+        return result
+
+current = None
+journal = None
+
+def get():
+    """The catalog of this process. The folder gets listed on first use."""
+    global current
+    if current is None:
+        current = Catalog(list_folder())
+    return current
+
+def reset():
+    """Forgets the catalog, so the next use lists the folder again."""
+    global current
+    current = None
+
+def added(file):
+    if current is not None:
+        current.add(file)
+    if journal is not None:
+        journal.append((True, file))
+
+def removed(file):
+    if current is not None:
+        current.remove(file)
+    if journal is not None:
+        journal.append((False, file))
+
+def start_journal():
+    """Starts recording the files that get added and removed."""
+    global journal
+    journal = []
+
+def take_journal():
+    """Returns what was recorded since start_journal() and stops recording."""
+    global journal
+    changes = journal or []
+    journal = None
+    return changes
+
+def replay(changes):
+    """Applies the journal of another process."""
+    for was_added, file in changes:
+        if was_added:
+            added(file)
+        else:
+            removed(file)
+
+def move_all(sharded):
+    moved = 0
+    for file in list_folder():
+        flat = os.path.join(awfy.path, file)
+        shard = os.path.join(awfy.path, 'shards', shard_of(file), file)
+        source, target = (flat, shard) if sharded else (shard, flat)
+        if not os.path.exists(source):
+            continue
+        if sharded:
+            shard_folder(file)
+        os.rename(source, target)
+        moved += 1
+    return moved
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--shard", dest="shard", action="store_true", default=False,
+                      help="Move the month files into shards.")
+    parser.add_option("--flatten", dest="flatten", action="store_true", default=False,
+                      help="Move the month files out of the shards.")
+    (options, args) = parser.parse_args(argv)
+
+    if options.shard == options.flatten:
+        parser.error('specify either --shard or --flatten')
+
+    print('Moved ' + str(move_all(options.shard)) + ' files')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
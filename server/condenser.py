@@ -3,53 +3,43 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import re
 import os
 import sys
 import awfy, util
 import math
 from profiler import Profiler
-from datetime import datetime
-import glob
+import partition
+import aggstate
+import rawstore
+import dense
+import pyramid
+import graphformat
+import manifest
+import catalog
 
-SecondsPerDay = 60 * 60 * 24
 MaxRecentRuns = 30
 
-class FolderChanger:
-    def __init__(self, folder):
-        self.old = os.getcwd()
-        self.new = folder
-
-    def __enter__(self):
-        os.chdir(self.new)
-
-    def __exit__(self, type, value, traceback):
-        os.chdir(self.old)
-
 def export(name, j):
-    path = os.path.join(awfy.path, name)
+    text = util.json_dumps(graphformat.compact(j))
+
+    # Leave unchanged exports alone, so their modification time (and with
+    # that the caches of the browsers) stays valid.
+    path = catalog.path_of(name)
     if os.path.exists(path):
+        with open(path) as fp:
+            if fp.read() == text:
+                return
         os.remove(path)
     with open(path, 'w') as fp:
-        util.json_dump(j, fp)
+        fp.write(text)
+    catalog.added(name)
 
 def find_all_months(cx, prefix, name):
-    pattern = prefix + 'raw-' + name + '-*-*.json'
-    re_pattern = prefix + 'raw-' + name + '-(\d\d\d\d)-(\d+)\.json'
-    
-    with FolderChanger(awfy.path):
-        files = []
-        for file in glob.glob(pattern):
-            m = re.match(re_pattern, file)
-            if not m:
-                continue
-
-            year = int(m.group(1))
-            month = int(m.group(2))
-            files.append(((year, month), file))
-
-    files = sorted(files, key=lambda key: key[0][0] * 12 + key[0][1])
-    return files
+    # Lazy subtests have no json caches, only their segments.
+    found = dict((when, file[:-len('.seg')] + '.json')
+                 for when, file in catalog.get().months('raw', prefix, name, 'seg'))
+    found.update(catalog.get().months('raw', prefix, name))
+    return sorted(found.items())
 
 def retrieve_graphs(cx, files):
     graphs = []
@@ -58,29 +48,13 @@ def retrieve_graphs(cx, files):
     return graphs
 
 def retrieve_graph(cx, file):
-    with open(os.path.join(awfy.path, file)) as fp:
-        cache = util.json_load(fp)
+    with open(catalog.path_of(file)) as fp:
+        cache = graphformat.expand(util.json_load(fp))
     return cache['graph']
 
-# Take a timelist and split it into lists of which times correspond to days.
-def split_into_days(timelist):
-    if not len(timelist):
-        return []
-
-    days = []
-
-    first = None
-    earliest = timelist[0]
-    for i, t in enumerate(timelist):
-        if t >= earliest + SecondsPerDay:
-            days.append((first, i))
-        first = i
-    days.append((first, i))
-
-    return days
-
 # Aggregate the datapoints in a graph into the supplied regions. Line ordering
-# stays the same.
+# stays the same. Points of regions with scores are
+#   [avg, first, last, suite_version, id, min, max, count, median, stddev]
 def condense_graph(graph, regions):
     # Prefill the new graph.
     new_graph = { 'direction': graph['direction'],
@@ -97,6 +71,7 @@ def condense_graph(graph, regions):
             last = None
             suite_version = None
             id = None
+            scores = []
             for i in range(start, end):
                 p = line['data'][i]
                 if not p or not p[0]:
@@ -108,11 +83,14 @@ def condense_graph(graph, regions):
                 last = p[1]
                 suite_version = p[3]
                 id = p[4]
+                scores.append(p[0])
             if count == 0:
-                avg = 0
-            else:
-                avg = total/count
-            points.append([avg, first, last, suite_version, id if count is 1 else None])
+                points.append([0, first, last, suite_version, None])
+                continue
+            avg = total/count
+            low, high, median, deviation = util.spread(scores)
+            points.append([avg, first, last, suite_version, id if count == 1 else None,
+                           low, high, count, median, deviation])
 
         newline = { 'modeid': line['modeid'],
                     'data': points
@@ -124,11 +102,31 @@ def condense_graph(graph, regions):
 
     return new_graph
 
-def condense_month(cx, suite, graph, prefix, name):
-    days = split_into_days(graph['timelist'])
-    new_graph = condense_graph(graph, days)
-
-    j = { 'version': awfy.version,
+# Exports the json of a raw month that changed, out of its segment.
+def export_month(prefix, raw_file, segment):
+    if not segment.valid() or not rawstore.keeps_json(prefix):
+        return None
+    graph = segment.graph()
+    j = { 'version': awfy.Version(),
+          'graph': graph
+        }
+    export(raw_file, j)
+    return graph
+
+def condense_month(cx, suite, prefix, raw_file, name):
+    segment = rawstore.Segment(raw_file[:-len('.json')])
+    raw_graph = export_month(prefix, raw_file, segment)
+
+    # With numpy the month is condensed straight from the columns of its
+    # segment.
+    if dense.numpy and segment.valid():
+        graph = dense.DenseGraph.from_segment(segment)
+        new_graph = graph.condense(partition.split_into_days(graph.timelist))
+    else:
+        graph = raw_graph or rawstore.retrieve_month(raw_file)
+        new_graph = condense_graph(graph, partition.split_into_days(graph['timelist']))
+
+    j = { 'version': awfy.Version(),
           'graph': new_graph
         }
     export(name + '.json', j)
@@ -179,76 +177,242 @@ def aggregate(cx, suite, prefix, name):
         sys.stdout.flush()
 
         files = find_all_months(cx, prefix, name)
-        graphs = retrieve_graphs(cx, files)
-        graph = combine([graph for when, graph in graphs])
+        paths = aggstate.update(prefix, name, files, manifest.generations(prefix, name))
 
-        graph['aggregate'] = True
+        # The number of slots and the lines of every month.
+        layout = []
+        for path in paths:
+            with aggstate.MonthState(path) as state:
+                layout.append((state.nslots, state.modes))
 
-        # If we don't have enough points for a historical view, we won't display
-        # a historical view.
-        if len(graph['timelist']) <= MaxRecentRuns:
-            if len(graph['timelist']) == 0:
-                graph['earliest'] = 0
-            else:
-                graph['earliest'] = graph['timelist'][0]
-            return graph
-
-        # Show MacRecentRuns of atleast one line.
-        recentRuns = 0
-        runs = []
-        for i in range(len(graph['lines'])):
-            runs.append(0)
-        for i in range(len(graph['timelist'])-1, -1, -1):
-            for j in range(len(graph['lines'])):
-                if graph['lines'] and i < len(graph['lines'][j]["data"]) and graph['lines'][j]["data"][i]:
-                    runs[j] += 1
-            recentRuns += 1
-            if max(runs) == MaxRecentRuns:
-                break
+        graph = aggregate_states(cx, files, paths, layout)
 
-        # If the number of historical points is <= the number of recent points,
-        # then the graph is about split so we don't have to do anything.
-        historical = len(graph['timelist']) - recentRuns
-        if historical <= MaxRecentRuns:
-            graph['earliest'] = graph['timelist'][historical]
-            return graph
-
-        # How big should each region be?
-        region_length = float(historical) / MaxRecentRuns
-
-        pos = 0
-        regions = []
-        for i in range(0, MaxRecentRuns):
-            start = int(round(pos))
-
-            end = min(int(math.floor(pos + region_length)), historical) - 1
-            if end < start:
-                end = start
-            regions.append((start, end))
-            pos += region_length
-
-        new_graph = condense_graph(graph, regions)
-        for i, line in enumerate(new_graph['lines']):
-            oldline = graph['lines'][i]
-            line['data'].extend(oldline['data'][historical:])
-        new_graph['timelist'].extend(graph['timelist'][historical:])
-
-        new_graph['earliest'] = graph['timelist'][historical]
-        new_graph['aggregate'] = True
-
-        # Sanity check.
-        for line in new_graph['lines']:
-            if len(line['data']) != len(new_graph['timelist']):
-                raise Exception('corrupt graph')
+        # The number of raw slots of every month, so the website can
+        # pick the level of the pyramid to zoom into.
+        graph['months'] = [[when[0], when[1], nslots]
+                           for (when, file), (nslots, modes) in zip(files, layout)]
 
         diff = p.time()
     print('took ' + diff)
-    return new_graph
+    return graph
+
+# The whole history, when it is too short to condense.
+def combine_all(cx, files, earliest):
+    graph = combine([rawstore.retrieve_month(file) for when, file in files])
+    graph['aggregate'] = True
+    if len(graph['timelist']) == 0:
+        graph['earliest'] = 0
+    else:
+        graph['earliest'] = graph['timelist'][earliest]
+    return graph
+
+# Condenses the historical part of a graph into regions, like
+# condense_graph() does, while walking the month states in order. Only the
+# region that is being filled is kept around, every region is emitted as
+# soon as the month it ends in was added. Regions exclude their end. The
+# spread of a region comes from the running sums of the month states too, so
+# there is no median.
+class RegionAggregator(object):
+    def __init__(self, modes, regions):
+        self.modes = modes
+        self.regions = regions
+        self.next = 0
+        self.direction = None
+        self.timelist = []
+        self.lines = dict((modeid, []) for modeid in modes)
+        self.reset()
+
+    def reset(self):
+        # Per line: sum and number of the valid scores, first cset, last
+        # (cset, suite_version, id), lowest and highest score and the sum of
+        # the squared deviations from the mean.
+        self.sums = dict((modeid, [0, 0, None, None, None, None, 0]) for modeid in self.modes)
+
+    def add(self, state, offset):
+        if self.direction is None:
+            self.direction = state.direction
+
+        end_of_month = offset + state.nslots
+        while self.next < len(self.regions):
+            start, end = self.regions[self.next]
+            if start >= end_of_month:
+                break
+            if start >= offset:
+                self.timelist.append(state.time(start - offset))
+
+            lo = max(start - offset, 0)
+            hi = min(end - offset, state.nslots)
+            if lo < hi:
+                for modeid in state.modes:
+                    total, count, first, last = state.summarize(modeid, lo, hi)
+                    sums = self.sums[modeid]
+                    if count:
+                        squares, low, high = state.spread(modeid, lo, hi)
+                        before = sums[1]
+                        if before:
+                            # Combines the spread with the one of the part of the
+                            # region that was added before.
+                            delta = total / count - sums[0] / before
+                            squares += delta ** 2 * before * count / (before + count)
+                            low = min(sums[4], low)
+                            high = max(sums[5], high)
+                        sums[4] = low
+                        sums[5] = high
+                        sums[6] += squares
+                    sums[0] += total
+                    sums[1] += count
+                    if not sums[2]:
+                        sums[2] = first
+                    if last:
+                        sums[3] = last
+
+            if end > end_of_month:
+                break
+            self.emit()
+            self.next += 1
+
+    def emit(self):
+        for modeid in self.modes:
+            total_score, count, first, last, low, high, squares = self.sums[modeid]
+            if count == 0:
+                self.lines[modeid].append([0, None, None, None, None])
+                continue
+            # Without any cset, condense_graph() ends up with the last.
+            if not first:
+                first = last[0]
+            self.lines[modeid].append([total_score/count, first, last[0], last[1],
+                                       last[2] if count == 1 else None,
+                                       low, high, count, None, math.sqrt(squares / count)])
+        self.reset()
+
+    def output(self):
+        return { 'direction': self.direction,
+                 'timelist': self.timelist,
+                 'lines': [{ 'modeid': modeid,
+                             'data': self.lines[modeid]
+                           } for modeid in self.modes]
+               }
+
+# The recent runs start at the MaxRecentRuns-th last point of the line for
+# which that comes latest. The months are walked from the end, until every
+# line has enough points or no line can start later than what was found.
+def find_historical(paths, offsets, modes):
+    needed = dict((modeid, MaxRecentRuns) for modeid in modes)
+    historical = 0
+    for i in range(len(paths) - 1, -1, -1):
+        if not needed:
+            break
+        # The lines that still need points start before the end of this
+        # month.
+        if i + 1 < len(offsets) and historical >= offsets[i + 1]:
+            break
+        with aggstate.MonthState(paths[i]) as state:
+            for modeid in state.modes:
+                if modeid not in needed:
+                    continue
+                count = state.points_before(modeid, state.nslots)
+                if count < needed[modeid]:
+                    needed[modeid] -= count
+                    continue
 
-def file_is_newer(file1, file2):
-    return os.path.getmtime(file1) >= os.path.getmtime(file2)
+                # Find the last slot with at least |needed| points from it on.
+                lo, hi = 0, state.nslots
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if count - state.points_before(modeid, mid) >= needed[modeid]:
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                historical = max(historical, offsets[i] + lo)
+                del needed[modeid]
+    return historical
+
+# Builds the aggregate out of the month states. The historical part is
+# condensed into MaxRecentRuns regions, the most recent runs are kept as is.
+# Months get visited one at a time, only the recent runs are loaded as a
+# whole.
+def aggregate_states(cx, files, paths, layout):
+    # Position of every month in the combined timelist, and the lines in the
+    # order combine() would put them.
+    offsets = []
+    total = 0
+    modes = []
+    for nslots, month_modes in layout:
+        offsets.append(total)
+        total += nslots
+        for modeid in month_modes:
+            if modeid not in modes:
+                modes.append(modeid)
+
+    # If we don't have enough points for a historical view, we won't display
+    # a historical view.
+    if total <= MaxRecentRuns:
+        return combine_all(cx, files, 0)
+
+    historical = find_historical(paths, offsets, modes)
+
+    # If the number of historical points is <= the number of recent points,
+    # then the graph is about split so we don't have to do anything.
+    if historical <= MaxRecentRuns:
+        return combine_all(cx, files, historical)
+
+    # How big should each region be?
+    region_length = float(historical) / MaxRecentRuns
+
+    pos = 0
+    regions = []
+    for i in range(0, MaxRecentRuns):
+        start = int(round(pos))
+
+        end = min(int(math.floor(pos + region_length)), historical) - 1
+        if end < start:
+            end = start
+        regions.append((start, end))
+        pos += region_length
+
+    aggregator = RegionAggregator(modes, regions)
+    for i, path in enumerate(paths):
+        if offsets[i] >= historical:
+            break
+        with aggstate.MonthState(path) as state:
+            aggregator.add(state, offsets[i])
+    new_graph = aggregator.output()
+
+    # Add the recent runs as they are.
+    datas = dict((line['modeid'], line['data']) for line in new_graph['lines'])
+    earliest = None
+    for i, (when, file) in enumerate(files):
+        if offsets[i] + layout[i][0] <= historical:
+            continue
+        graph = rawstore.retrieve_month(file)
+        skip = max(historical - offsets[i], 0)
+        if earliest is None:
+            earliest = graph['timelist'][skip]
+        lines = dict((line['modeid'], line['data']) for line in graph['lines'])
+        for modeid in modes:
+            if modeid in lines:
+                datas[modeid].extend(lines[modeid][skip:])
+            else:
+                datas[modeid].extend([None] * (len(graph['timelist']) - skip))
+        new_graph['timelist'].extend(graph['timelist'][skip:])
+
+    new_graph['earliest'] = earliest
+    new_graph['aggregate'] = True
+
+    # Sanity check.
+    for line in new_graph['lines']:
+        if len(line['data']) != len(new_graph['timelist']):
+            raise Exception('corrupt graph')
+
+    return new_graph
 
 def condense(cx, suite, prefix, name):
+    # Nothing to do when none of the raw months got written since the last
+    # time. This only reads the manifests.
+    if not manifest.dirty(prefix, name):
+        return False
+    overall = manifest.partition_generation(prefix, name)
+
     with Profiler() as p:
         sys.stdout.write('Importing all datapoints for ' + name + '... ')
         sys.stdout.flush()
@@ -258,17 +422,21 @@ def condense(cx, suite, prefix, name):
 
     print('took ' + diff)
 
+    built = manifest.Outputs(prefix + 'condensed-' + name)
     if not len(files):
+        built.record_all(overall)
+        built.save()
         return False
 
     change = False
+    generation = manifest.generations(prefix, name)
 
     for when, raw_file in files:
-        condensed_name = prefix + 'condensed-' + name + '-' + str(when[0]) + '-' + str(when[1])
+        condensed_name = prefix + 'condensed-' + name + partition.month_suffix(when)
         condensed_file = condensed_name + '.json'
 
-        # Only update the graph when condensed file is older.
-        if os.path.exists(os.path.join(awfy.path, condensed_file)) and file_is_newer(os.path.join(awfy.path, condensed_file), os.path.join(awfy.path, raw_file)):
+        # Only update the graph when the raw month changed since.
+        if os.path.exists(catalog.path_of(condensed_file)) and built.current(when, generation(when)):
             continue
 
         # There was a datapoint added to one of the condensed files.
@@ -278,12 +446,26 @@ def condense(cx, suite, prefix, name):
             sys.stdout.write('Condensing ' + condensed_name + '... ')
             sys.stdout.flush()
 
-            graph = retrieve_graph(cx, raw_file)
-
-            condense_month(cx, suite, graph, prefix, condensed_name)
+            condense_month(cx, suite, prefix, raw_file, condensed_name)
+            built.record(when, generation(when))
             diff = p.time()
         print(' took ' + diff)
 
+    # A month that is gone changes the aggregate too.
+    if built.prune(files):
+        change = True
+    built.record_all(overall)
+    built.save()
+
+    with Profiler() as p:
+        sys.stdout.write('Updating the pyramid of ' + name + '... ')
+        sys.stdout.flush()
+
+        if pyramid.update(prefix, name, files, generation):
+            change = True
+        diff = p.time()
+    print('took ' + diff)
+
     return change
 
 def condense_suite(cx, machine, suite):
@@ -298,29 +480,34 @@ def condense_suite(cx, machine, suite):
     # Aggregate suite if needed.
     aggregated_file = prefix + 'aggregate-' + name + '.json'
     if change:
-        j = { 'version': awfy.version,
+        j = { 'version': awfy.Version(),
               'graph': aggregate(cx, suite, prefix, name)
             }
         export(aggregated_file, j)
 
-        # Note: only run the subtest condenser when suite was changed.
+    # Every subtest is a partition of its own, which only gets condensed
+    # when its raw months changed. Lazy subtests are left to graphservice.py.
+    if not awfy.lazy_subtests:
         for test_name in suite.tests:
             test_path = suite.name + '-' + test_name + '-' + str(machine.id)
+            condense_subtest(cx, suite, prefix + 'bk-', test_path)
 
-            # Condense test
-            change = condense(cx, suite, prefix + 'bk-', test_path)
-
-            # Aggregate suite if needed.
-            if change:
-                j = { 'version': awfy.version,
-                      'graph': aggregate(cx, suite, prefix + 'bk-', test_path)
-                    }
-                export(prefix + 'bk-aggregate-' + test_path + '.json', j)
-
-    if not os.path.exists(os.path.join(awfy.path, aggregated_file)):
+    if not os.path.exists(catalog.path_of(aggregated_file)):
         return None
     return retrieve_graph(cx, aggregated_file)
 
+def condense_subtest(cx, suite, prefix, name):
+    # Condense test
+    change = condense(cx, suite, prefix, name)
+
+    # Aggregate test if needed.
+    if change:
+        j = { 'version': awfy.Version(),
+              'graph': aggregate(cx, suite, prefix, name)
+            }
+        export(prefix + 'aggregate-' + name + '.json', j)
+    return change
+
 
 def condense_all(cx):
     for machine in cx.machines:
@@ -341,7 +528,7 @@ def condense_all(cx):
                 continue
             aggregates[suite.name] = suite_aggregate
 
-        j = { 'version': awfy.version,
+        j = { 'version': awfy.Version(),
               'graphs': aggregates
             }
         export('aggregate-' + str(machine.id) + '.json', j)
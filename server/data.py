@@ -5,27 +5,17 @@
 
 import awfy
 import time
+from profiler import Profiler
 
 class Benchmark(object):
-    def __init__(self, suite_id, name, description, direction, sort_order, visible):
+    def __init__(self, suite_id, name, description, direction, sort_order, visible, tests):
         self.id = suite_id
         self.name =  name
         self.description = description
         self.direction = direction
         self.sort_order = sort_order
         self.visible = visible
-
-        # Get a list of individual tests
-        self.tests = []
-        c = awfy.db.cursor()
-        c.execute("SELECT t.name                                                          \
-                   FROM awfy_suite_test t                                                 \
-                   JOIN awfy_suite_version v ON v.id = t.suite_version_id                 \
-                   WHERE suite_id = %s                                                    \
-                   AND visible = 1                                                        \
-                   GROUP BY t.name", (suite_id,))
-        for row in c.fetchall():
-            self.tests.append(row[0])
+        self.tests = tests
 
     def export(self):
         return { "id": self.id,
@@ -47,7 +37,8 @@ class Vendor(object):
         self.rangeURL = rangeURL
 
 class Machine(object):
-    def __init__(self, id, os, cpu, description, active, frontpage, pushed_separate, message):
+    def __init__(self, id, os, cpu, description, active, frontpage, pushed_separate, message,
+                 recent_runs, suites):
         self.id = id
         self.os = os
         self.cpu = cpu
@@ -56,30 +47,8 @@ class Machine(object):
         self.frontpage = frontpage
         self.pushed_separate = pushed_separate
         self.message = message
-        self.recent_runs = False
-
-        c = awfy.db.cursor()
-        c.execute("SELECT finish_stamp FROM awfy_run                                      \
-                   WHERE machine = %s AND                                                 \
-                         status = 1 AND                                                   \
-                         finish_stamp > UNIX_TIMESTAMP() - 60*60*24*7                     \
-                   ORDER BY finish_stamp DESC                                             \
-                   LIMIT 1", (id,))
-        if c.rowcount > 0:
-            self.recent_runs = True
-
-        self.suites = []
-        c.execute("SELECT DISTINCT(suite_version_id) FROM awfy_run                        \
-                   JOIN `awfy_build` ON awfy_run.id = run_id                              \
-                   JOIN `awfy_score` ON awfy_build.id = build_id                          \
-                   WHERE machine = %s", (id,))
-        ids = [str(row[0]) for row in c.fetchall()]
-        if len(ids) > 0:
-                c.execute("SELECT DISTINCT(awfy_suite.name) FROM awfy_suite                       \
-                           JOIN `awfy_suite_version` ON suite_id = awfy_suite.id                  \
-                           WHERE awfy_suite_version.id in ("+(",".join(ids))+")")
-                for row in c.fetchall():
-                    self.suites.append(row[0])
+        self.recent_runs = recent_runs
+        self.suites = suites
 
     def export(self):
         return { "id": self.id,
@@ -102,48 +71,150 @@ class Mode(object):
         self.color = color
         self.level = level
 
+def id_list(ids):
+    return ",".join(str(int(id)) for id in ids)
+
+# The loaders below fetch what used to be queried per suite or per machine
+# with one query for all given ids.
+
+# Returns the names of the visible tests of every suite.
+def load_tests(suite_ids):
+    tests = dict((suite_id, []) for suite_id in suite_ids)
+    if not len(suite_ids):
+        return tests
+    c = awfy.db.cursor()
+    c.execute("SELECT v.suite_id, t.name                                              \
+               FROM awfy_suite_test t                                                 \
+               JOIN awfy_suite_version v ON v.id = t.suite_version_id                 \
+               WHERE v.suite_id IN ("+id_list(suite_ids)+")                           \
+               AND visible = 1                                                        \
+               GROUP BY v.suite_id, t.name                                            \
+               ORDER BY v.suite_id, t.name")
+    for row in c.fetchall():
+        tests[row[0]].append(row[1])
+    return tests
+
+# Returns the machines which finished a run in the last week.
+def load_recent_runs(machine_ids):
+    if not len(machine_ids):
+        return set()
+    c = awfy.db.cursor()
+    c.execute("SELECT DISTINCT(machine) FROM awfy_run                                 \
+               WHERE machine IN ("+id_list(machine_ids)+") AND                        \
+                     status = 1 AND                                                   \
+                     finish_stamp > UNIX_TIMESTAMP() - 60*60*24*7")
+    return set(row[0] for row in c.fetchall())
+
+# Returns the names of the suites every machine has scores for. Reads the
+# summary the website maintains when runs finish, instead of going through
+# all scores of the machine.
+def load_machine_suites(machine_ids):
+    suites = dict((machine_id, []) for machine_id in machine_ids)
+    if not len(machine_ids):
+        return suites
+    c = awfy.db.cursor()
+    c.execute("SELECT DISTINCT ms.machine_id, awfy_suite.id, awfy_suite.name           \
+               FROM awfy_machine_suite ms                                             \
+               JOIN awfy_suite_version ON awfy_suite_version.id = ms.suite_version_id \
+               JOIN awfy_suite ON awfy_suite.id = awfy_suite_version.suite_id         \
+               WHERE ms.machine_id IN ("+id_list(machine_ids)+")                      \
+               ORDER BY ms.machine_id, awfy_suite.id")
+    for row in c.fetchall():
+        suites[row[0]].append(row[2])
+    return suites
+
+# Changes whenever the version or one of the tables the context is built from
+# (apart from the runs) changes. Cheap enough to poll.
+def signature():
+    c = awfy.db.cursor()
+    rows = []
+    for query in ["SELECT `value` FROM awfy_config WHERE `key` = 'version'",
+                  "SELECT id, name, vendor, csetURL, browser, rangeURL FROM awfy_vendor",
+                  "SELECT id, vendor_id, mode, name, color, level FROM awfy_mode",
+                  "SELECT id, name, description, better_direction, sort_order, visible FROM awfy_suite",
+                  "SELECT COUNT(*), MAX(id) FROM awfy_suite_version",
+                  "SELECT id, os, cpu, description, active, frontpage, pushed_separate, message FROM awfy_machine"]:
+        c.execute(query)
+        rows.append(tuple(tuple(row) for row in c.fetchall()))
+    return tuple(rows)
+
 class Context(object):
     def __init__(self):
-        # Get a list of vendors, and map vendor IDs -> vendor info
-        self.vendors = []
+        self.suitemap = { }
+        self.rows = { }
+        self.refresh(set())
 
+    # Brings a long-lived context up to date. Everything is reloaded, apart
+    # from the tests of a suite. Those are only requeried for new or changed
+    # suites, or when they received new runs according to |dirty|, a set of
+    # (machine id, suite id) pairs.
+    def refresh(self, dirty):
+        dirty_suites = set(pair[1] for pair in dirty)
         c = awfy.db.cursor()
-        c.execute("SELECT id, name, vendor, csetURL, browser, rangeURL FROM awfy_vendor")
-        for row in c.fetchall():
-            v = Vendor(row[0], row[1], row[2], row[3], row[4], row[5])
-            self.vendors.append(v)
-
-        # Get a list of modes, and a reverse mapping from DB ids.
-        self.modes = []
-        self.modemap = { }
-        c.execute("SELECT id, vendor_id, mode, name, color, level FROM awfy_mode WHERE level <= 10")
-        for row in c.fetchall():
-            m = Mode(row[0], row[1], row[2], row[3], row[4], row[5])
-            self.modemap[int(row[0])] = m
-            self.modes.append(m)
-
-        # Get a list of benchmark suites.
-        self.suitemap = {}
-        self.benchmarks = []
-        c.execute("SELECT id, name, description, better_direction, sort_order, visible FROM awfy_suite WHERE visible > 0")
-        for row in c.fetchall():
-            b = Benchmark(row[0], row[1], row[2], row[3], row[4], row[5])
-            self.suitemap[row[0]] = b
-            self.benchmarks.append(b)
-
-        # Get a list of suite versions
-        self.suiteversions = []
-        c.execute("SELECT id, name, suite_id FROM awfy_suite_version")
-        for row in c.fetchall():
-            if row[2] in self.suitemap:
-                self.suiteversions.append([row[0], row[1], self.suitemap[row[2]].name])
-
-        # Get a list of machines.
-        self.machines = []
-        c.execute("SELECT id, os, cpu, description, active, frontpage, pushed_separate, message FROM awfy_machine WHERE active >= 1")
-        for row in c.fetchall():
-            m = Machine(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7])
-            self.machines.append(m)
+
+        with Profiler('  vendors and modes'):
+            # Get a list of vendors, and map vendor IDs -> vendor info
+            self.vendors = []
+            c.execute("SELECT id, name, vendor, csetURL, browser, rangeURL FROM awfy_vendor")
+            for row in c.fetchall():
+                v = Vendor(row[0], row[1], row[2], row[3], row[4], row[5])
+                self.vendors.append(v)
+
+            # Get a list of modes, and a reverse mapping from DB ids.
+            self.modes = []
+            self.modemap = { }
+            c.execute("SELECT id, vendor_id, mode, name, color, level FROM awfy_mode WHERE level <= 10")
+            for row in c.fetchall():
+                m = Mode(row[0], row[1], row[2], row[3], row[4], row[5])
+                self.modemap[int(row[0])] = m
+                self.modes.append(m)
+
+        with Profiler('  suites and tests'):
+            # Get a list of benchmark suites.
+            c.execute("SELECT id, name, description, better_direction, sort_order, visible FROM awfy_suite WHERE visible > 0")
+            rows = c.fetchall()
+            stale = [row[0] for row in rows
+                     if self.stale('suite', row, dirty_suites) or row[0] not in self.suitemap]
+            tests = load_tests(stale)
+
+            suitemap = {}
+            self.benchmarks = []
+            for row in rows:
+                if row[0] in tests:
+                    b = Benchmark(row[0], row[1], row[2], row[3], row[4], row[5], tests[row[0]])
+                else:
+                    b = self.suitemap[row[0]]
+                suitemap[row[0]] = b
+                self.benchmarks.append(b)
+            self.suitemap = suitemap
+
+            # Get a list of suite versions
+            self.suiteversions = []
+            c.execute("SELECT id, name, suite_id FROM awfy_suite_version")
+            for row in c.fetchall():
+                if row[2] in self.suitemap:
+                    self.suiteversions.append([row[0], row[1], self.suitemap[row[2]].name])
+
+        with Profiler('  machines'):
+            c.execute("SELECT id, os, cpu, description, active, frontpage, pushed_separate, message FROM awfy_machine WHERE active >= 1")
+            rows = c.fetchall()
+            machine_ids = [row[0] for row in rows]
+            recent_runs = load_recent_runs(machine_ids)
+            suites = load_machine_suites(machine_ids)
+
+            self.machines = []
+            for row in rows:
+                m = Machine(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7],
+                            row[0] in recent_runs, suites[row[0]])
+                self.machines.append(m)
+
+    # Whether the object of a row needs to be (re)built. Remembers the row.
+    def stale(self, kind, row, dirty):
+        key = (kind, row[0])
+        if key in self.rows and self.rows[key] == tuple(row) and row[0] not in dirty:
+            return False
+        self.rows[key] = tuple(row)
+        return True
 
     def exportModes(self):
         o = { }
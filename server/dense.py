@@ -0,0 +1,167 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Vectorized condensing of raw months, used when numpy is installed.
+#
+# A month is loaded straight from the columns of its segment (see
+# rawstore.py) into dense (line x slot) arrays, so no datapoint passes
+# through python. condense() gives the same output as
+# condenser.condense_graph() on the json export of the segment, except that
+# the averages and deviations can differ in the last bits, since numpy adds
+# and squares the scores in its own way.
+
+
+try:
+    import numpy
+except:
+    numpy = None
+
+class DenseGraph(object):
+    def __init__(self, direction, timelist, modes, csets, present, scores, cset, version, id):
+        self.direction = direction
+        self.timelist = timelist
+        self.modes = modes
+        self.csets = csets
+        self.present = present
+        self.scores = scores
+        self.cset = cset
+        self.version = version
+        self.id = id
+
+    @staticmethod
+    def from_segment(segment):
+        blocks = list(segment.blocks())
+
+        # Lines in the order segment.graph() gives them.
+        timelist = []
+        modes = []
+        for block in blocks:
+            timelist.extend(block.times)
+            for modeid in block.modes:
+                if modeid not in modes:
+                    modes.append(modeid)
+        line_index = dict((modeid, i) for i, modeid in enumerate(modes))
+
+        shape = (len(modes), len(timelist))
+        present = numpy.zeros(shape, dtype=bool)
+        scores = numpy.zeros(shape)
+        cset = numpy.full(shape, -1, dtype=numpy.int32)
+        version = numpy.full(shape, -1, dtype=numpy.int32)
+        id = numpy.full(shape, -1, dtype=numpy.int32)
+
+        base = 0
+        csets = []
+        for block in blocks:
+            lines = numpy.array([line_index[modeid] for modeid in block.modes], dtype=numpy.int32)
+            rows = lines[numpy.asarray(block.line, dtype=numpy.int32)]
+            cols = base + numpy.asarray(block.slot, dtype=numpy.int32)
+
+            present[rows, cols] = True
+            scores[rows, cols] = numpy.asarray(block.score)
+            block_cset = numpy.asarray(block.cset, dtype=numpy.int32)
+            cset[rows, cols] = numpy.where(block_cset >= 0, block_cset + len(csets), -1)
+            version[rows, cols] = numpy.asarray(block.version, dtype=numpy.int32)
+            id[rows, cols] = numpy.asarray(block.id, dtype=numpy.int32)
+
+            csets.extend(block.csets)
+            base += len(block.times)
+
+        return DenseGraph(segment.direction(), timelist, modes, csets,
+                          present, scores, cset, version, id)
+
+    def condense(self, regions):
+        new_graph = { 'direction': self.direction,
+                      'timelist': [self.timelist[start] for start, end in regions],
+                      'lines': []
+                    }
+
+        nlines, nslots = self.scores.shape
+        if not nslots or not nlines or not len(regions):
+            for modeid in self.modes:
+                new_graph['lines'].append({ 'modeid': modeid,
+                                            'data': [[0, None, None, None, None] for region in regions]
+                                          })
+            return new_graph
+
+        # Points count when they have a score, and a cset when it isn't empty.
+        valid = self.present & (self.scores != 0)
+        nonempty = numpy.array([bool(cset) for cset in self.csets] + [False])
+        has_cset = valid & nonempty[self.cset]
+
+        starts = numpy.array([start for start, end in regions])
+        ends = numpy.array([max(start, end) for start, end in regions])
+
+        # The regions are laid out side by side, padded to the longest one:
+        # entry [k, r, j] is the k-th slot of region r on line j. Everything
+        # gets reduced over the first axis.
+        lengths = ends - starts
+        position = numpy.arange(max(int(lengths.max()), 1))[:, None]
+        inside = position < lengths[None, :]
+        slots = numpy.where(inside, starts[None, :] + position, 0)
+        taken = valid.T[slots] & inside[:, :, None]
+        region_scores = self.scores.T[slots]
+
+        counts = taken.sum(axis=0)
+        totals = numpy.where(taken, region_scores, 0.0).sum(axis=0)
+        means = totals / numpy.maximum(counts, 1)
+        squares = numpy.where(taken, (region_scores - means) ** 2, 0.0)
+        deviations = numpy.sqrt(squares.sum(axis=0) / numpy.maximum(counts, 1))
+
+        # Sorting every region puts its valid scores first.
+        ordered = numpy.sort(numpy.where(taken, region_scores, numpy.inf), axis=0)
+        def nth(index):
+            index = numpy.clip(index, 0, ordered.shape[0] - 1)
+            return numpy.take_along_axis(ordered, index[None, :, :], axis=0)[0]
+        lows = nth(counts * 0)
+        highs = nth(counts - 1)
+        medians = numpy.where(counts % 2, nth(counts // 2),
+                              (nth(counts // 2 - 1) + nth(counts // 2)) / 2.0)
+
+        # The last point that counts at or before every slot and the first one
+        # with a cset at or after every slot.
+        index = numpy.arange(nslots)
+        last_valid = numpy.maximum.accumulate(numpy.where(valid, index, -1), axis=1)
+        first_cset = numpy.minimum.accumulate(numpy.where(has_cset, index, nslots)[:, ::-1],
+                                              axis=1)[:, ::-1]
+        lasts = last_valid[:, numpy.maximum(ends - 1, 0)].tolist()
+        firsts = first_cset[:, numpy.minimum(starts, nslots - 1)].tolist()
+
+        csets = self.csets + [None]
+        cset = self.cset.tolist()
+        version = self.version.tolist()
+        id = self.id.tolist()
+        ends = ends.tolist()
+        counts = counts.T.tolist()
+        means = means.T.tolist()
+        lows = lows.T.tolist()
+        highs = highs.T.tolist()
+        medians = medians.T.tolist()
+        deviations = deviations.T.tolist()
+        for j, modeid in enumerate(self.modes):
+            points = []
+            for r in range(len(regions)):
+                count = counts[j][r]
+                if count == 0:
+                    points.append([0, None, None, None, None])
+                    continue
+
+                last = lasts[j][r]
+                first = firsts[j][r]
+                if first >= ends[r]:
+                    # Without any cset, condense_graph() ends up with the last.
+                    first = last
+                points.append([means[j][r],
+                               csets[cset[j][first]],
+                               csets[cset[j][last]],
+                               version[j][last] if version[j][last] >= 0 else None,
+                               id[j][last] if count == 1 and id[j][last] >= 0 else None,
+                               lows[j][r], highs[j][r], count, medians[j][r],
+                               deviations[j][r]])
+
+            new_graph['lines'].append({ 'modeid': modeid,
+                                        'data': points
+                                      })
+
+        return new_graph
@@ -0,0 +1,113 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compact encoding of the exported graphs.
+#
+# Lines are padded with null to the length of the timelist, so graphs of
+# machines running many modes at different cadences are mostly null. A
+# compact graph only stores the points that are there, and keeps the csets
+# and suite_version ids in a table shared by all lines:
+#
+#   { 'format': 1,
+#     'direction': ..., 'timelist': [...], (other keys are kept as is)
+#     'table': [cset or suite_version, ...],
+#     'lines': [{ 'modeid': ...,
+#                 'gaps': [number of null slots before every point],
+#                 'data': [[score, first, last, suite_version, id, ...]] }]
+#   }
+#
+# first, last and suite_version are indexes into the table (or null). Any
+# fields after the id are kept as is. decode() in python and
+# AWFY.decodeGraph in website/awfy.js turn it back into the padded graph.
+
+import copy
+
+FormatVersion = 1
+
+# The fields of a point that go into the table.
+TableFields = [1, 2, 3]
+
+def encode(graph):
+    table = []
+    table_index = { }
+
+    def index_of(value):
+        if value is None:
+            return None
+        key = (type(value), value)
+        if key not in table_index:
+            table_index[key] = len(table)
+            table.append(value)
+        return table_index[key]
+
+    compact = dict((key, value) for key, value in graph.items() if key != 'lines')
+    compact['format'] = FormatVersion
+    compact['lines'] = []
+    for line in graph['lines']:
+        gaps = []
+        data = []
+        gap = 0
+        for p in line['data']:
+            if p is None:
+                gap += 1
+                continue
+            p = list(p)
+            for field in TableFields:
+                p[field] = index_of(p[field])
+            gaps.append(gap)
+            data.append(p)
+            gap = 0
+        compact['lines'].append({ 'modeid': line['modeid'],
+                                  'gaps': gaps,
+                                  'data': data
+                                })
+    compact['table'] = table
+    return compact
+
+def decode(graph):
+    """Returns the padded graph of a compact one. Graphs which aren't compact
+    are returned as they are."""
+    if 'format' not in graph:
+        return graph
+    if graph['format'] != FormatVersion:
+        raise Exception('unknown graph format ' + str(graph['format']))
+
+    table = graph['table']
+    nslots = len(graph['timelist'])
+    padded = dict((key, value) for key, value in graph.items()
+                  if key not in ('format', 'table', 'lines'))
+    padded['lines'] = []
+    for line in graph['lines']:
+        data = [None] * nslots
+        slot = 0
+        for gap, p in zip(line['gaps'], line['data']):
+            slot += gap
+            p = list(p)
+            for field in TableFields:
+                if p[field] is not None:
+                    p[field] = table[p[field]]
+            data[slot] = p
+            slot += 1
+        padded['lines'].append({ 'modeid': line['modeid'],
+                                 'data': data
+                               })
+    return padded
+
+def compact(j):
+    """Encodes the graphs of an export ('graph' or 'graphs')."""
+    j = copy.copy(j)
+    if 'graph' in j:
+        j['graph'] = encode(j['graph'])
+    if 'graphs' in j:
+        j['graphs'] = dict((name, encode(graph)) for name, graph in j['graphs'].items())
+    return j
+
+def expand(j):
+    """Decodes the graphs of an export, compact or not."""
+    if 'graph' in j:
+        j['graph'] = decode(j['graph'])
+    if 'graphs' in j:
+        j['graphs'] = dict((name, decode(graph)) for name, graph in j['graphs'].items())
+    return j
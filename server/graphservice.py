@@ -0,0 +1,250 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# On-demand graphs of the subtests.
+#
+# There is a bk- partition for every subtest of every suite on every
+# machine, but only a few of them ever get looked at. With lazy_subtests set
+# in the config, update.py keeps only the segments (see rawstore.py) of the
+# subtests and the condenser skips them. Their condensed months, pyramid and
+# aggregate get built by this service instead, the first time
+# website/data.php asks for one of their files. The files end up in the data
+# folder just like the condenser would write them, so data.php serves them
+# from there afterwards. Lazy subtests have no json of their raw months
+# either, the service exports the one of a month when it's asked for.
+#
+# The built subtests are kept in an LRU. A subtest gets rebuilt on access
+# when any of its raw months changed since (see manifest.py), and its files
+# get removed when it's evicted: when more than --max-graphs subtests are
+# built, or when it wasn't asked for in --max-idle seconds.
+#
+#   python graphservice.py [--port 8010] [--max-graphs 500] [--max-idle 604800]
+#
+# GET /<file> returns the file, building its subtest first if needed, or 404
+# when the subtest has no raw months. HEAD /<file> does the same without
+# returning the file, which is what data.php uses before serving it from the
+# data folder itself. GET /stats returns the counters.
+
+import os
+import re
+import sys
+import time
+import collections
+from optparse import OptionParser
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+import awfy
+import util
+import catalog
+import condenser
+import manifest
+import partition
+import rawstore
+
+FilePattern = re.compile('^((?:auth-)?bk-)(aggregate|condensed|raw|lod\d+)-([^/]+?)(?:-(\d\d\d\d)-(\d+))?\.json$')
+
+# Outputs of a subtest that record the raw month generations they were
+# built from.
+OutputKinds = ['condensed', 'lod', 'aggstate', 'rawjson']
+
+class GraphService(object):
+    def __init__(self, max_graphs, max_idle):
+        self.max_graphs = max_graphs
+        self.max_idle = max_idle
+        # (prefix, name) of the built subtests to the time of their last
+        # access, least recently used first.
+        self.graphs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def seed(self):
+        """Picks up the subtests that were built before a restart, so they
+        can get evicted too. Those without an aggregate go first."""
+        found = []
+        for prefix, name in catalog.get().graphs('condensed'):
+            if not prefix.endswith('bk-'):
+                continue
+            path = catalog.path_of(prefix + 'aggregate-' + name + '.json')
+            accessed = os.path.getmtime(path) if os.path.exists(path) else 0
+            found.append((accessed, (prefix, name)))
+        for accessed, key in sorted(found):
+            self.graphs[key] = accessed
+
+    def request(self, file):
+        """Returns the path of a subtest file, or None if there is none."""
+        m = FilePattern.match(file)
+        if not m:
+            return None
+        key = (m.group(1), m.group(3))
+        when = None
+        if m.group(4):
+            when = (int(m.group(4)), int(m.group(5)))
+        if m.group(2) == 'raw' and when is None:
+            return None
+
+        self.expire()
+        if key not in self.graphs:
+            self.misses += 1
+            built = self.build(key)
+        elif manifest.dirty(*key):
+            self.stale += 1
+            built = self.build(key)
+        else:
+            self.hits += 1
+            built = True
+        if not built:
+            self.graphs.pop(key, None)
+            return None
+
+        self.graphs.pop(key, None)
+        self.graphs[key] = time.time()
+        while len(self.graphs) > self.max_graphs:
+            self.evict(self.graphs.popitem(last = False)[0])
+
+        if m.group(2) == 'raw' and not self.export_raw(key, when, file):
+            return None
+
+        path = catalog.path_of(file)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def build(self, key):
+        prefix, name = key
+        self.sync_months(prefix, name)
+        if not len(condenser.find_all_months(None, prefix, name)):
+            return False
+        condenser.condense_subtest(None, None, prefix, name)
+        return os.path.exists(catalog.path_of(prefix + 'aggregate-' + name + '.json'))
+
+    def sync_months(self, prefix, name):
+        # update.py runs in a process of its own, so the catalog doesn't know
+        # about the months it added or deleted since the folder got listed.
+        # Those are all in the manifest of the raw months, so only the months
+        # of this subtest need a look, not the whole folder.
+        known = dict(catalog.get().months('raw', prefix, name, 'seg'))
+        for when in manifest.months(prefix, name):
+            file = prefix + 'raw-' + name + partition.month_suffix(when) + '.seg'
+            exists = os.path.exists(catalog.path_of(file))
+            if exists and when not in known:
+                catalog.added(file)
+            elif not exists and when in known:
+                catalog.removed(file)
+
+    def export_raw(self, key, when, file):
+        # Exports the json of a raw month out of its segment, unless it is
+        # there already and its month didn't change since.
+        prefix, name = key
+        segment = rawstore.Segment(file[:-len('.json')])
+        if not segment.valid():
+            return False
+        generation = manifest.generations(prefix, name)(when)
+        built = manifest.Outputs(prefix + 'rawjson-' + name)
+        if built.current(when, generation) and os.path.exists(catalog.path_of(file)):
+            return True
+        j = { 'version': awfy.Version(),
+              'graph': segment.graph()
+            }
+        condenser.export(file, j)
+        built.record(when, generation)
+        built.save()
+        return True
+
+    def expire(self):
+        oldest = time.time() - self.max_idle
+        while len(self.graphs):
+            key, accessed = next(iter(self.graphs.items()))
+            if accessed >= oldest:
+                break
+            del self.graphs[key]
+            self.evict(key)
+
+    def evict(self, key):
+        prefix, name = key
+        files = [prefix + 'aggregate-' + name + '.json']
+        for ext in ['json', 'bin']:
+            for kind, when, file in catalog.get().files(prefix, name, ext):
+                # Only the json of the raw months that got exported here.
+                if kind != 'raw' or (ext == 'json' and not rawstore.keeps_json(prefix)):
+                    files.append(file)
+        for file in files:
+            path = catalog.path_of(file)
+            if os.path.exists(path):
+                os.remove(path)
+            catalog.removed(file)
+
+        # Without their manifests, the next build starts from scratch.
+        for kind in OutputKinds:
+            path = manifest.path_of(prefix + kind + '-' + name)
+            if os.path.exists(path):
+                os.remove(path)
+        self.evictions += 1
+
+    def stats(self):
+        return { 'graphs': len(self.graphs),
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'stale': self.stale,
+                 'evictions': self.evictions
+               }
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.answer(True)
+
+    def do_HEAD(self):
+        self.answer(False)
+
+    def answer(self, send_body):
+        service = self.server.service
+        file = self.path.lstrip('/')
+        if file == 'stats':
+            body = util.json_dumps(service.stats()).encode('utf-8')
+            self.reply(len(body), body if send_body else None)
+            return
+
+        path = service.request(file)
+        if path is None:
+            self.send_error(404)
+            return
+        if not send_body:
+            self.reply(os.path.getsize(path))
+            return
+        with open(path, 'rb') as fp:
+            body = fp.read()
+        self.reply(len(body), body)
+
+    def reply(self, length, body = None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--port", dest="port", type="int", default=8010)
+    parser.add_option("--max-graphs", dest="max_graphs", type="int", default=500,
+                      help="Number of subtests to keep built.")
+    parser.add_option("--max-idle", dest="max_idle", type="int", default=7 * 24 * 3600,
+                      help="Seconds after which a subtest that wasn't asked for gets removed.")
+    (options, args) = parser.parse_args(argv)
+
+    service = GraphService(options.max_graphs, options.max_idle)
+    service.seed()
+
+    # Only local, data.php is the one to check the permissions.
+    server = HTTPServer(('localhost', options.port), Handler)
+    server.service = service
+    print('Serving subtest graphs on port ' + str(options.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Generation counters of the raw months.
+#
+# Every time update.py writes a raw month, it bumps the generation of that
+# month in the manifest of its partition (manifest-<prefix>raw-<name>.json).
+# Everything built out of raw months (condensed months, pyramid levels,
+# aggregate states) records the generation of every month it was built
+# from in a manifest of its own, and only gets rebuilt when the generations
+# differ. Unlike file modification times, generations survive copying the
+# data folder and don't miss two writes within the same second.
+#
+# A manifest is a json object from 'Y-M' to the generation. Months which
+# were never written with a manifest in place are at generation 0. Next to
+# the months, 'all' counts the writes to any month of the partition, so
+# whether anything changed since the outputs were built can be told without
+# looking at the months at all.
+
+import os
+import awfy
+import util
+import partition
+
+AllKey = 'all'
+
+def path_of(name):
+    return os.path.join(awfy.path, 'manifest-' + name + '.json')
+
+def month_key(when):
+    return str(when[0]) + '-' + str(when[1])
+
+def load(name):
+    try:
+        with open(path_of(name)) as fp:
+            return util.json_load(fp)
+    except:
+        return { }
+
+def save(name, months):
+    path = path_of(name)
+    with open(path + '.tmp', 'w') as fp:
+        util.json_dump(months, fp)
+    os.rename(path + '.tmp', path)
+
+def bump(month_name, when):
+    """Bumps the generation of a raw month, given by the name of its cache
+    (<prefix>raw-<name>-Y-M). Also used when a month gets deleted."""
+    name = month_name[:-len(partition.month_suffix(when))]
+    months = load(name)
+    key = month_key(when)
+    months[key] = months.get(key, 0) + 1
+    months[AllKey] = months.get(AllKey, 0) + 1
+    save(name, months)
+
+def generations(prefix, name):
+    """Returns the generation of every raw month of a graph, keyed by month."""
+    months = load(prefix + 'raw-' + name)
+    return lambda when: months.get(month_key(when), 0)
+
+def months(prefix, name):
+    """Returns every raw month of a graph that was written (or deleted)
+    with a manifest in place."""
+    found = []
+    for key in load(prefix + 'raw-' + name):
+        if key != AllKey:
+            year, month = key.split('-')
+            found.append((int(year), int(month)))
+    return sorted(found)
+
+def partition_generation(prefix, name):
+    """Returns the number of writes to any raw month of a graph."""
+    return load(prefix + 'raw-' + name).get(AllKey, 0)
+
+def dirty(prefix, name):
+    """Whether any raw month of a graph changed since it got condensed."""
+    built = load(prefix + 'condensed-' + name)
+    return built.get(AllKey) != partition_generation(prefix, name)
+
+class Outputs(object):
+    """The generations of the raw months that the outputs of one kind (e.g.
+    <prefix>condensed-<name>) were built from."""
+    def __init__(self, name):
+        self.name = name
+        self.months = load(name)
+        self.changed = False
+
+    def current(self, when, generation):
+        return self.months.get(month_key(when)) == generation
+
+    def record(self, when, generation):
+        self.months[month_key(when)] = generation
+        self.changed = True
+
+    def record_all(self, generation):
+        self.months[AllKey] = generation
+        self.changed = True
+
+    def prune(self, files):
+        """Forgets the months which are not in |files| anymore (as returned
+        by find_all_months). Returns whether there were any."""
+        keep = set(month_key(when) for when, file in files)
+        keep.add(AllKey)
+        gone = [key for key in self.months if key not in keep]
+        for key in gone:
+            del self.months[key]
+            self.changed = True
+        return len(gone) > 0
+
+    def save(self):
+        if self.changed:
+            save(self.name, self.months)
+            self.changed = False
@@ -81,6 +81,18 @@ for task in tasks:
     text = """AreWeFastYet has not received results from machine {0} (task_id {1}) in {2} hours.
     """.format(machine_description, task_id, delta)
 
+    # Also mention the last time the machine reported any scores at all.
+    c.execute("""
+               SELECT MAX(last_seen)
+               FROM awfy_machine_suite
+               WHERE machine_id = %s
+              """,
+              (task_machine_id,))
+    last_seen = c.fetchone()
+    if last_seen and last_seen[0]:
+        text += """Last scores of this machine are from {0}.
+    """.format(time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(last_seen[0])))
+
     message = MIMEText(text)
     message['Subject'] = 'AreWeFastYet Machine {0} id {1} not reporting'.format(
         machine_description,
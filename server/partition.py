@@ -0,0 +1,48 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# The month and day boundaries used to partition the caches. Everything is
+# in UTC, so the month a datapoint gets stored in is also the month which
+# gets refetched when that cache is renewed.
+
+import time
+import calendar
+
+SecondsPerDay = 60 * 60 * 24
+
+def month_of(stamp):
+    t = time.gmtime(stamp)
+    return (t.tm_year, t.tm_mon)
+
+def next_month(when):
+    if when[1] == 12:
+        return (when[0] + 1, 1)
+    return (when[0], when[1] + 1)
+
+# Returns the first and the last second of the month.
+def month_bounds(when):
+    start = calendar.timegm((when[0], when[1], 1, 0, 0, 0))
+    after = next_month(when)
+    stop = calendar.timegm((after[0], after[1], 1, 0, 0, 0)) - 1
+    return (start, stop)
+
+def month_suffix(when):
+    return '-' + str(when[0]) + '-' + str(when[1])
+
+def day_of(stamp):
+    return int(stamp) // SecondsPerDay
+
+# Take a timelist and split it into (start, end) ranges of the indexes that
+# fall on the same day. The end is exclusive.
+def split_into_days(timelist):
+    days = []
+    start = 0
+    for i in range(1, len(timelist)):
+        if day_of(timelist[i]) != day_of(timelist[start]):
+            days.append((start, i))
+            start = i
+    if len(timelist):
+        days.append((start, len(timelist)))
+    return days
@@ -0,0 +1,155 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Level-of-detail pyramid for zooming into the graphs.
+#
+# Every raw month gets reduced by the factors in Factors, each level stored
+# next to the raw month as <prefix>lod<factor>-<name>-Y-M.json. Factor 1 is
+# the raw month itself. A level has the shape of the raw caches, but every
+# slot is a region of |factor| consecutive slots of the raw month and every
+# point summarizes the scores of its region:
+#
+#   [mean, first cset, last cset, suite_version, id, min, max, count,
+#    median, stddev]
+#
+# which are the fields condense_graph() gives. Like there, only scores that
+# are there and not zero count, and the id is only kept when the region has a
+# single score. Regions without any score are null. Since levels are merged
+# out of the level below, the median is only known when every point of the
+# level below stands for a single score; otherwise it's null.
+#
+# Every level is built from the one below it, so a raw month is read only
+# once, and only months of which the generation changed (see manifest.py)
+# get rebuilt. The
+# website picks the coarsest level that still gives enough points for the
+# zoomed window (see the months list that condenser.py adds to the
+# aggregates).
+
+import os
+import re
+import math
+import awfy
+import util
+import partition
+import rawstore
+import graphformat
+import manifest
+import catalog
+
+Factors = [4, 16, 64]
+
+def level_name(prefix, factor, name, when):
+    return prefix + 'lod' + str(factor) + '-' + name + partition.month_suffix(when) + '.json'
+
+def summarize(p):
+    """The region point of a single raw point."""
+    if not p or not p[0]:
+        return None
+    return [p[0], p[1], p[1], p[3], p[4], p[0], p[0], 1, p[0], 0.0]
+
+def merge(points):
+    """Merges region points into the point of their combined region."""
+    total = 0
+    squares = 0
+    count = 0
+    first = None
+    last = None
+    low = None
+    high = None
+    singles = []
+    for p in points:
+        if not p:
+            continue
+        total += p[0] * p[7]
+        squares += p[7] * (p[9] ** 2 + p[0] ** 2)
+        count += p[7]
+        if p[7] == 1:
+            singles.append(p[0])
+        if not first:
+            first = p[1]
+        last = p
+        low = p[5] if low is None else min(low, p[5])
+        high = p[6] if high is None else max(high, p[6])
+    if count == 0:
+        return None
+    # Without any cset, condense_graph() ends up with the last.
+    if not first:
+        first = last[2]
+    mean = total / count
+    median = None
+    if len(singles) == count:
+        median = util.spread(singles)[2]
+    deviation = math.sqrt(max(squares / count - mean ** 2, 0))
+    return [mean, first, last[2], last[3], last[4] if count == 1 else None,
+            low, high, count, median, deviation]
+
+def reduce_graph(graph, ratio, points_of = None):
+    """Merges every |ratio| consecutive slots of a graph. The region points
+    of the slots are given by points_of."""
+    new_graph = { 'direction': graph['direction'],
+                  'timelist': graph['timelist'][::ratio],
+                  'lines': []
+                }
+    nslots = len(graph['timelist'])
+    for line in graph['lines']:
+        data = line['data']
+        if points_of:
+            data = [points_of(p) for p in data]
+        new_graph['lines'].append({ 'modeid': line['modeid'],
+                                    'data': [merge(data[start:start + ratio])
+                                             for start in range(0, nslots, ratio)]
+                                  })
+    return new_graph
+
+def build(graph):
+    """Returns the levels of a raw month graph, as (factor, graph) pairs."""
+    levels = []
+    below = 1
+    for factor in Factors:
+        if below == 1:
+            level = reduce_graph(graph, factor, summarize)
+        else:
+            level = reduce_graph(levels[-1][1], factor // below)
+        levels.append((factor, level))
+        below = factor
+    return levels
+
+def update(prefix, name, files, generation):
+    """Brings the levels of the given raw months (as returned by
+    find_all_months) up to date. |generation| gives the generation of a raw
+    month. Levels of months which are gone get removed. Returns whether any
+    level got rebuilt."""
+    wanted = set()
+    change = False
+    built = manifest.Outputs(prefix + 'lod-' + name)
+    for when, raw_file in files:
+        names = [level_name(prefix, factor, name, when) for factor in Factors]
+        wanted.update(names)
+
+        paths = [catalog.path_of(level_file) for level_file in names]
+        if built.current(when, generation(when)) and all(os.path.exists(path) for path in paths):
+            continue
+
+        change = True
+        for (factor, graph), path in zip(build(rawstore.retrieve_month(raw_file)), paths):
+            j = { 'version': awfy.Version(),
+                  'graph': graph
+                }
+            with open(path + '.tmp', 'w') as fp:
+                util.json_dump(graphformat.compact(j), fp)
+            os.rename(path + '.tmp', path)
+            catalog.added(os.path.basename(path))
+        built.record(when, generation(when))
+
+    if built.prune(files):
+        change = True
+    built.save()
+
+    for kind, when, level_file in catalog.get().files(prefix, name):
+        if re.match('lod\d+$', kind) and level_file not in wanted:
+            os.remove(catalog.path_of(level_file))
+            catalog.removed(level_file)
+
+    return change
@@ -0,0 +1,292 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Append-only columnar store for the raw month caches.
+#
+# Every (prefix, month) gets one segment file (<name>.seg) next to the json
+# caches. A segment is a file header followed by blocks. Every update appends
+# one block, so appending costs O(new points) and never rewrites old data.
+#
+#   file header:  'AWFYSEG2' direction:int32
+#   block header: 'BLK1' nslots nmodes npoints ncsets size   (uint32 each)
+#   block body:   times    int32[nslots]    timelist of this block
+#                 modes    int32[nmodes]    mode id of every line in the block
+#                 slot     int32[npoints]   index into times
+#                 line     int32[npoints]   index into modes
+#                 cset     int32[npoints]   index into csets (-1 for none)
+#                 version  int32[npoints]   suite_version id (-1 for none)
+#                 id       int32[npoints]   score id (-1 for none)
+#                 run      int32[npoints]   run id (-1 for unknown)
+#                 score    float64[npoints]
+#                 csets    ncsets * (length:uint16 utf-8 bytes)
+#
+# All arrays are little-endian and every column of a block is contiguous, so
+# a reader can memory-map the file and wrap the columns directly. 'size' is
+# the byte length of the body. A block that was only partially written (e.g.
+# the process got killed) is ignored by readers and cut off by the next
+# append.
+#
+# The segments are what update.py writes and what the condenser reads. The
+# json caches of the raw months, which the website loads when zooming in, are
+# exported from the segments by the condenser, once per update for every
+# month that changed.
+
+import os
+import re
+import mmap
+import struct
+import awfy
+import catalog
+import util
+import graphformat
+
+FileMagic = b'AWFYSEG2'
+FileHeader = struct.Struct('<8si')
+BlockMagic = b'BLK1'
+BlockHeader = struct.Struct('<4sIIIII')
+CsetLength = struct.Struct('<H')
+
+IntColumns = ['slot', 'line', 'cset', 'version', 'id', 'run']
+
+def path_of(name):
+    return catalog.path_of(name + '.seg')
+
+def keeps_json(prefix):
+    """Whether the raw months of a partition also get exported as json, for
+    the website. Lazy subtests only keep their segments, see
+    graphservice.py."""
+    return not (awfy.lazy_subtests and re.match('(auth-)?bk-', prefix))
+
+def exists(name):
+    return os.path.exists(path_of(name))
+
+def delete(name):
+    if exists(name):
+        os.remove(path_of(name))
+        catalog.removed(name + '.seg')
+
+class Block(object):
+    """The decoded columns of one block."""
+    def __init__(self, buf, offset):
+        magic, nslots, nmodes, npoints, ncsets, size = BlockHeader.unpack_from(buf, offset)
+        pos = offset + BlockHeader.size
+        self.end = pos + size
+
+        self.times = util.unpack_array('i', buf[pos:pos + 4 * nslots])
+        pos += 4 * nslots
+        self.modes = util.unpack_array('i', buf[pos:pos + 4 * nmodes])
+        pos += 4 * nmodes
+        for column in IntColumns:
+            setattr(self, column, util.unpack_array('i', buf[pos:pos + 4 * npoints]))
+            pos += 4 * npoints
+        self.score = util.unpack_array('d', buf[pos:pos + 8 * npoints])
+        pos += 8 * npoints
+
+        self.csets = []
+        for i in range(ncsets):
+            length, = CsetLength.unpack_from(buf, pos)
+            pos += CsetLength.size
+            self.csets.append(buf[pos:pos + length].decode('utf-8'))
+            pos += length
+
+def block_offsets(buf):
+    """Returns the offsets of all complete blocks and the offset directly
+    after the last complete block."""
+    offsets = []
+    pos = FileHeader.size
+    while pos + BlockHeader.size <= len(buf):
+        magic, nslots, nmodes, npoints, ncsets, size = BlockHeader.unpack_from(buf, pos)
+        end = pos + BlockHeader.size + size
+        if magic != BlockMagic or end > len(buf):
+            break
+        offsets.append(pos)
+        pos = end
+    return offsets, pos
+
+class Segment(object):
+    def __init__(self, name):
+        self.name = name
+        self.path = path_of(name)
+
+    def valid(self):
+        """Whether the segment exists and is in the current format."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as fp:
+            return fp.read(len(FileMagic)) == FileMagic
+
+    def _map(self, fp):
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def blocks(self):
+        """Memory-maps the segment and yields all complete blocks."""
+        with open(self.path, 'rb') as fp:
+            buf = self._map(fp)
+            try:
+                if buf[:len(FileMagic)] != FileMagic:
+                    raise Exception('corrupt segment ' + self.name)
+                offsets, end = block_offsets(buf)
+                for offset in offsets:
+                    yield Block(buf, offset)
+            finally:
+                if buf:
+                    buf.close()
+
+    def direction(self):
+        with open(self.path, 'rb') as fp:
+            magic, direction = FileHeader.unpack(fp.read(FileHeader.size))
+        return direction
+
+    def last_time(self):
+        """Timestamp of the last datapoint, or None if the segment is empty.
+        Only reads the block headers and the last timestamp."""
+        with open(self.path, 'rb') as fp:
+            buf = self._map(fp)
+            try:
+                offsets, end = block_offsets(buf)
+                for offset in reversed(offsets):
+                    magic, nslots, nmodes, npoints, ncsets, size = BlockHeader.unpack_from(buf, offset)
+                    if nslots:
+                        pos = offset + BlockHeader.size + 4 * (nslots - 1)
+                        return util.unpack_array('i', buf[pos:pos + 4])[0]
+                return None
+            finally:
+                if buf:
+                    buf.close()
+
+    def append(self, graph, runs = { }):
+        """Appends a graph in the json shape (timelist + lines) as a new
+        block. The graph must be in the order of the existing data.
+        |runs| maps (modeid, id) of a point to the id of its run."""
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as fp:
+                fp.write(FileHeader.pack(FileMagic, graph['direction'] or 0))
+            catalog.added(self.name + '.seg')
+
+        modes = []
+        csets = []
+        cset_index = { }
+        columns = dict((column, []) for column in IntColumns)
+        scores = []
+        for line in graph['lines']:
+            modes.append(int(line['modeid']))
+            for slot, point in enumerate(line['data']):
+                if not point:
+                    continue
+                cset = point[1]
+                if cset is None:
+                    index = -1
+                elif cset in cset_index:
+                    index = cset_index[cset]
+                else:
+                    index = len(csets)
+                    cset_index[cset] = index
+                    csets.append(cset)
+                columns['slot'].append(slot)
+                columns['line'].append(len(modes) - 1)
+                columns['cset'].append(index)
+                columns['version'].append(-1 if point[3] is None else int(point[3]))
+                columns['id'].append(-1 if point[4] is None else int(point[4]))
+                columns['run'].append(runs.get((modes[-1], point[4]), -1))
+                scores.append(float(point[0]))
+
+        body = [util.pack_array('i', graph['timelist']), util.pack_array('i', modes)]
+        for column in IntColumns:
+            body.append(util.pack_array('i', columns[column]))
+        body.append(util.pack_array('d', scores))
+        for cset in csets:
+            encoded = cset.encode('utf-8')
+            body.append(CsetLength.pack(len(encoded)))
+            body.append(encoded)
+        body = b''.join(body)
+
+        header = BlockHeader.pack(BlockMagic, len(graph['timelist']), len(modes),
+                                  len(scores), len(csets), len(body))
+
+        with open(self.path, 'r+b') as fp:
+            # Cut off a block that was partially written before.
+            buf = self._map(fp)
+            try:
+                offsets, end = block_offsets(buf)
+            finally:
+                if buf:
+                    buf.close()
+            fp.truncate(end)
+            fp.seek(end)
+            fp.write(header + body)
+
+    def replace(self, graph, runs = { }):
+        """Replaces the content of the segment with the given graph."""
+        tmp = Segment(self.name + '.tmp')
+        if os.path.exists(tmp.path):
+            os.remove(tmp.path)
+        tmp.append(graph, runs)
+        os.rename(tmp.path, self.path)
+        catalog.added(self.name + '.seg')
+
+    def points(self):
+        """Yields all datapoints in the row shape of the score queries:
+        (run, time, cset, score, modeid, suite_version, id)."""
+        for block in self.blocks():
+            for i in range(len(block.score)):
+                cset = block.cset[i]
+                version = block.version[i]
+                id = block.id[i]
+                yield (block.run[i] if block.run[i] >= 0 else None,
+                       block.times[block.slot[i]],
+                       block.csets[cset] if cset >= 0 else None,
+                       block.score[i],
+                       block.modes[block.line[i]],
+                       version if version >= 0 else None,
+                       id if id >= 0 else None)
+
+    def graph(self):
+        """Exports the segment in the json shape of the raw caches."""
+        timelist = []
+        lines = []
+        line_index = { }
+        for block in self.blocks():
+            base = len(timelist)
+            timelist.extend(block.times)
+
+            # Line order is the order in which the modes first appeared.
+            block_lines = []
+            for modeid in block.modes:
+                if modeid not in line_index:
+                    line_index[modeid] = len(lines)
+                    lines.append({ 'modeid': modeid,
+                                   'data': [] })
+                block_lines.append(lines[line_index[modeid]]['data'])
+
+            for data in [line['data'] for line in lines]:
+                data.extend([None] * (len(timelist) - len(data)))
+
+            for i in range(len(block.score)):
+                cset = block.cset[i]
+                version = block.version[i]
+                id = block.id[i]
+                block_lines[block.line[i]][base + block.slot[i]] = [
+                    block.score[i],
+                    block.csets[cset] if cset >= 0 else None,
+                    None,
+                    version if version >= 0 else None,
+                    id if id >= 0 else None
+                ]
+
+        return { 'direction': self.direction(),
+                 'timelist': timelist,
+                 'lines': lines
+               }
+
+def retrieve_month(raw_file):
+    """The graph of a raw month (given by the name of its json cache), out of
+    its segment if there is one. Lazy subtests only have the segment."""
+    segment = Segment(raw_file[:-len('.json')])
+    if segment.valid():
+        return segment.graph()
+    with open(catalog.path_of(raw_file)) as fp:
+        return graphformat.expand(util.json_load(fp))['graph']
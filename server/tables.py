@@ -3,8 +3,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import re
+import sys
+import time
 import awfy
 import types
+import collections
 
 RUNS_FACTOR = 1
 NOISE_FACTOR = 2
@@ -25,6 +29,104 @@ def camelcase(string):
     class_ = string.__class__
     return class_.join('', map(class_.capitalize, splitted_string))
 
+# Rows are loaded this many ids per query.
+BATCH_SIZE = 500
+
+def estimate_size(value):
+  # Lists are the children attached by Run.eager(). The rows of the children
+  # are in the caches of their own tables.
+  if isinstance(value, list):
+    return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+  return sys.getsizeof(value)
+
+class RowCache(object):
+  """The rows of one table keyed on id, least recently used first. Rows get
+  evicted when their estimated size goes over the limit (in bytes). The ids
+  of the last BATCH_SIZE objects that were created but not initialized yet
+  are pending, so the next miss can load them along in the same query."""
+  def __init__(self, limit):
+    self.limit = limit
+    self.rows = collections.OrderedDict()
+    self.size = 0
+    self.pending = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __contains__(self, id):
+    return id in self.rows
+
+  def get(self, id):
+    if id not in self.rows:
+      self.misses += 1
+      return None
+    self.hits += 1
+    row, size = self.rows.pop(id)
+    self.rows[id] = (row, size)
+    return row
+
+  def put(self, id, row):
+    self.discard(id)
+    size = sys.getsizeof(row) + sum(estimate_size(value) for value in row.values())
+    self.rows[id] = (row, size)
+    self.size += size
+    self.pending.pop(id, None)
+    self.evict()
+
+  def attach(self, id, row, name, value):
+    """Sets a field of a row that isn't a column, e.g. an object it refers
+    to or a list of children, and counts it in the size of the row."""
+    if name in row:
+      self.resize(id, row, -estimate_size(row[name]))
+    row[name] = value
+    self.resize(id, row, estimate_size(value))
+
+  def resize(self, id, row, delta):
+    # Rows that got evicted in the meantime don't count anymore.
+    if id not in self.rows or self.rows[id][0] is not row:
+      return
+    self.rows[id] = (row, self.rows[id][1] + delta)
+    self.size += delta
+    if delta > 0:
+      self.evict()
+
+  def evict(self):
+    while self.size > self.limit and len(self.rows) > 1:
+      old_id, (old_row, old_size) = self.rows.popitem(last=False)
+      self.size -= old_size
+      self.evictions += 1
+
+  def peek(self, id):
+    if id not in self.rows:
+      return None
+    return self.rows[id][0]
+
+  def discard(self, id):
+    if id in self.rows:
+      row, size = self.rows.pop(id)
+      self.size -= size
+
+  def add_pending(self, id):
+    if id in self.pending:
+      return
+    self.pending[id] = True
+    if len(self.pending) > BATCH_SIZE:
+      self.pending.popitem(last=False)
+
+  def take_pending(self, count):
+    """Takes up to |count| pending ids, oldest first."""
+    ids = []
+    while self.pending and len(ids) < count:
+      ids.append(self.pending.popitem(last=False)[0])
+    return ids
+
+  def stats(self):
+    return { "rows": len(self.rows),
+             "size": self.size,
+             "hits": self.hits,
+             "misses": self.misses,
+             "evictions": self.evictions }
+
 class DBTable(object):
   globalcache = {}
 
@@ -39,40 +141,82 @@ class DBTable(object):
     self.id = int(id)
     self.initialized = False
     self.cached = None
+    cache = self.cache()
+    if self.id not in cache:
+      cache.add_pending(self.id)
+
+  @classmethod
+  def cache(class_):
+    table = class_.table()
+    if table not in DBTable.globalcache:
+      DBTable.globalcache[table] = RowCache(awfy.row_cache_size * 1024 * 1024)
+    return DBTable.globalcache[table]
+
+  @staticmethod
+  def cache_stats():
+    return dict((table, DBTable.globalcache[table].stats()) for table in DBTable.globalcache)
 
   def exists(self):
     self.initialize()
     return self.cached != None
 
-  def prefetch(self):
-    if self.table() not in self.__class__.globalcache:
-      self.__class__.globalcache[self.table()] = {}
+  @classmethod
+  def load(class_, ids):
+    """Loads the rows of the given ids into the cache, BATCH_SIZE ids per
+    query. Returns the rows that were found, keyed on id."""
+    cache = class_.cache()
+    ids = list(set(ids))
+    rows = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+      chunk = ids[start:start + BATCH_SIZE]
+      c = awfy.db.cursor()
+      c.execute("SELECT *                                                       \
+                 FROM "+class_.table()+"                                        \
+                 WHERE id IN ("+",".join(["%s"] * len(chunk))+")", chunk)
+      for row in class_.store(c):
+        rows[row["id"]] = row
+      for id in chunk:
+        cache.pending.pop(id, None)
+    return rows
 
-    c = awfy.db.cursor()
-    c.execute("SELECT *                                                         \
-               FROM "+self.table()+"                                            \
-               WHERE id > %s - 100 AND                                          \
-                     id < %s + 100                                              \
-               ", (self.id, self.id))
+  @classmethod
+  def store(class_, c):
+    """Puts the rows of an executed query on all columns of the table into
+    the cache. Returns the rows."""
+    cache = class_.cache()
+    rows = []
     for row in c.fetchall():
-      cache = {}
+      cached = {}
       for i in range(len(row)):
-        cache[c.description[i][0]] = row[i]
-      self.__class__.globalcache[self.table()][cache["id"]] = cache
+        cached[c.description[i][0]] = row[i]
+      cache.put(cached["id"], cached)
+      rows.append(cached)
+    return rows
+
+  @classmethod
+  def fromRow(class_, row):
+    obj = class_(row["id"])
+    obj.initialized = True
+    obj.cached = row
+    return obj
+
+  def children(self, name):
+    # The lists of child objects are only there after Run.eager().
+    row = self.cached if self.initialized else self.cache().peek(self.id)
+    if row is None or name not in row:
+      return None
+    return row[name]
 
   def initialize(self):
     if self.initialized:
       return
 
     self.initialized = True
-    if self.table() in self.__class__.globalcache:
-      if self.id in self.__class__.globalcache[self.table()]:
-        self.cached = self.__class__.globalcache[self.table()][self.id]
-        return
-
-    self.prefetch()
-    if self.id in self.__class__.globalcache[self.table()]:
-        self.cached = self.__class__.globalcache[self.table()][self.id]
+    cache = self.cache()
+    self.cached = cache.get(self.id)
+    if self.cached is None:
+      ids = [self.id] + cache.take_pending(BATCH_SIZE - 1)
+      self.cached = self.load(ids).get(self.id)
     return
 
   def get(self, field):
@@ -85,7 +229,7 @@ class DBTable(object):
       id_ = self.cached[field+"_id"]
       class_ = get_class(camelcase(field))
       value = class_(id_)
-      self.cached[field] = value
+      self.cache().attach(self.id, self.cached, field, value)
       return self.cached[field]
     assert False
 
@@ -95,11 +239,19 @@ class DBTable(object):
     c.execute("UPDATE "+self.table()+"                                          \
                SET "+",".join(sets)+"                                           \
                WHERE id = %s", (self.id, ))
+    self.forget()
+
+  def forget(self):
+    # The row gets loaded again on the next get().
+    self.cache().discard(self.id)
+    self.initialized = False
+    self.cached = None
 
   def delete(self):
     c = awfy.db.cursor()
     c.execute("DELETE FROM "+self.table()+"                                        \
                WHERE id = %s", (self.id, ))
+    self.forget()
 
   @staticmethod
   def valuefy(value):
@@ -119,6 +271,72 @@ class DBTable(object):
                VALUES ("+",".join(values)+")")
     return c.lastrowid
 
+  @staticmethod
+  def columns(data):
+    # Column names end up in the statement, the values are parameters.
+    for key in data:
+      if not re.match("^[a-zA-Z_][a-zA-Z0-9_]*$", key):
+        raise TypeError("%s is not a column name." % key)
+    return sorted(data.keys())
+
+  @staticmethod
+  def placeholder(value):
+    if value == "UNIX_TIMESTAMP()":
+      return value
+    return "%s"
+
+  @classmethod
+  def execute_many(class_, rows, statement, chunk_size, verb):
+    # Groups the rows on their statement, and runs every group with
+    # executemany, chunk_size rows at a time and with a commit per chunk.
+    groups = {}
+    for row in rows:
+      sql, params = statement(row)
+      groups.setdefault(sql, []).append(params)
+
+    begin = time.time()
+    count = 0
+    c = awfy.db.cursor()
+    for sql in groups:
+      params = groups[sql]
+      for start in range(0, len(params), chunk_size):
+        c.executemany(sql, params[start:start + chunk_size])
+        awfy.db.commit()
+        count += len(params[start:start + chunk_size])
+
+    took = time.time() - begin
+    print(verb + " " + str(count) + " rows of " + class_.table() + " in %.2fs (%d rows/s)" %
+          (took, count / took if took > 0 else 0))
+    return count
+
+  @classmethod
+  def insert_many(class_, rows, chunk_size = BATCH_SIZE):
+    """Inserts the given dicts of column values with parameterized
+    statements. Returns the number of rows."""
+    def statement(data):
+      keys = DBTable.columns(data)
+      values = [data[key] for key in keys if data[key] != "UNIX_TIMESTAMP()"]
+      sql = "INSERT INTO "+class_.table()+" ("+",".join(keys)+") \
+             VALUES ("+",".join(DBTable.placeholder(data[key]) for key in keys)+")"
+      return sql, values
+    return class_.execute_many(rows, statement, chunk_size, "Inserted")
+
+  @classmethod
+  def update_many(class_, rows, chunk_size = BATCH_SIZE):
+    """Updates rows given as (id, dict of column values) pairs with
+    parameterized statements. Returns the number of rows."""
+    cache = class_.cache()
+    def statement(row):
+      id, data = row
+      cache.discard(int(id))
+      keys = DBTable.columns(data)
+      values = [data[key] for key in keys if data[key] != "UNIX_TIMESTAMP()"]
+      sql = "UPDATE "+class_.table()+" \
+             SET "+",".join(key + " = " + DBTable.placeholder(data[key]) for key in keys)+" \
+             WHERE id = %s"
+      return sql, values + [id]
+    return class_.execute_many(rows, statement, chunk_size, "Updated")
+
   @classmethod
   def all(class_):
     c = awfy.db.cursor()
@@ -134,13 +352,6 @@ class DBTable(object):
     for row in c.fetchall():
         yield class_(row[0])
 
-  @classmethod
-  def maybeflush(class_):
-    #TODO
-    records = 0
-    for i in class_.globalcache:
-        records += len(class_.globalcache[i].keys())
-
 class Run(DBTable):
   def __init__(self, id):
     DBTable.__init__(self, id)
@@ -157,16 +368,84 @@ class Run(DBTable):
        self.cached["machine_id"] = self.cached["machine"]
        del self.cached["machine"]
 
-  def getScores(self):
+  def getBuilds(self):
+    builds = self.children("builds")
+    if builds is not None:
+      return builds
+
     c = awfy.db.cursor()
     c.execute("SELECT id                                                              \
                FROM awfy_build                                                        \
                WHERE run_id = %s", (self.id,))
+    return [Build(row[0]) for row in c.fetchall()]
+
+  def getScores(self):
     scores = []
-    for row in c.fetchall():
-      scores += Build(row[0]).getScores()
+    for build in self.getBuilds():
+      scores += build.getScores()
     return scores
 
+  def eager(self):
+    """Loads the builds, scores and breakdowns of the run together with
+    their suite versions, suites, suite tests and modes, with one query per
+    table. Returns the builds. Nothing reachable from them through get(),
+    getScores() and getBreakdowns() needs another query (as long as it
+    stays in the cache)."""
+    # Take the row the cache holds, self.cached can be an older one (e.g.
+    # after update()). It's only loaded when it isn't cached.
+    self.initialized = False
+    self.initialize()
+
+    c = awfy.db.cursor()
+    c.execute("SELECT *                                                               \
+               FROM awfy_build                                                        \
+               WHERE run_id = %s", (self.id,))
+    builds = Build.store(c)
+    c.execute("SELECT awfy_score.*                                                    \
+               FROM awfy_score                                                        \
+               JOIN awfy_build ON awfy_build.id = awfy_score.build_id                 \
+               WHERE awfy_build.run_id = %s", (self.id,))
+    scores = Score.store(c)
+    c.execute("SELECT awfy_breakdown.*                                                \
+               FROM awfy_breakdown                                                    \
+               JOIN awfy_score ON awfy_score.id = awfy_breakdown.score_id             \
+               JOIN awfy_build ON awfy_build.id = awfy_score.build_id                 \
+               WHERE awfy_build.run_id = %s", (self.id,))
+    breakdowns = Breakdown.store(c)
+
+    versions = SuiteVersion.load([row["suite_version_id"] for row in scores
+                                  if row["suite_version_id"] is not None])
+    Suite.load([row["suite_id"] for row in versions.values()])
+    SuiteTest.load([row["suite_test_id"] for row in breakdowns])
+    Mode.load([row["mode_id"] for row in builds])
+
+    # Link everything up, so every row refers to the same objects.
+    build_objs = dict((row["id"], Build.fromRow(row)) for row in builds)
+    score_objs = dict((row["id"], Score.fromRow(row)) for row in scores)
+    scores_of = dict((row["id"], []) for row in builds)
+    breakdowns_of = dict((row["id"], []) for row in scores)
+    for row in scores:
+      scores_of[row["build_id"]].append(score_objs[row["id"]])
+    for row in breakdowns:
+      breakdowns_of[row["score_id"]].append(Breakdown.fromRow(row))
+
+    for row in builds:
+      Build.cache().attach(row["id"], row, "run", self)
+      Build.cache().attach(row["id"], row, "scores", scores_of[row["id"]])
+    for row in scores:
+      Score.cache().attach(row["id"], row, "build", build_objs[row["build_id"]])
+      Score.cache().attach(row["id"], row, "breakdowns", breakdowns_of[row["id"]])
+    for row in breakdowns:
+      Breakdown.cache().attach(row["id"], row, "parent", score_objs[row["score_id"]])
+
+    # Put the row back if it got evicted in the meantime, so the builds end
+    # up where the next get() finds them.
+    cache = self.cache()
+    if cache.peek(self.id) is not self.cached:
+      cache.put(self.id, self.cached)
+    cache.attach(self.id, self.cached, "builds", [build_objs[row["id"]] for row in builds])
+    return self.cached["builds"]
+
 class SuiteTest(DBTable):
   def __init__(self, id):
     DBTable.__init__(self, id)
@@ -229,6 +508,10 @@ class Build(DBTable):
     return Build(rows[0][0])
 
   def getScores(self):
+    scores = self.children("scores")
+    if scores is not None:
+      return scores
+
     scores = []
     c = awfy.db.cursor()
     c.execute("SELECT id                                                              \
@@ -251,6 +534,10 @@ class Score(RegressionTools):
     return "awfy_score"
 
   def getBreakdowns(self):
+    breakdowns = self.children("breakdowns")
+    if breakdowns is not None:
+      return breakdowns
+
     c = awfy.db.cursor()
     c.execute("SELECT awfy_breakdown.id                                               \
                FROM awfy_breakdown                                                    \
@@ -270,8 +557,15 @@ class Breakdown(RegressionTools):
 
   def get(self, field):
     if field == "build_id":
-      return Score(self.get("score_id")).get("build_id")
+      return self.parent().get("build_id")
     if field == "build":
-      return Score(self.get("score_id")).get("build")
+      return self.parent().get("build")
 
     return super(Breakdown, self).get(field)
+
+  def parent(self):
+    # "score" is the column with the value, so the Score is kept as "parent".
+    self.initialize()
+    if "parent" not in self.cached:
+      self.cache().attach(self.id, self.cached, "parent", Score(self.cached["score_id"]))
+    return self.cached["parent"]
@@ -9,11 +9,18 @@ import awfy
 import data
 import time
 import util
+import traceback
 import os.path
-import datetime
+import multiprocessing
 import condenser, json
+import rawstore
+import partition
+import graphformat
+import manifest
+import catalog
+from optparse import OptionParser
 from profiler import Profiler
-from builder import LineBuilder, GraphBuilder
+from builder import GraphBuilder
 
 def export(name, j):
     path = os.path.join(awfy.path, name)
@@ -42,48 +49,54 @@ def delete_metadata(prefix, data):
     if os.path.exists(name):
         os.remove(name)
 
+def partition_lock(prefix):
+    # Guards the metadata and raw caches of one (machine, suite) partition,
+    # so that parallel workers never touch the same files. The lock files
+    # stay around (removing them would race with a worker that opened one
+    # already), so they get a folder of their own, which data.php doesn't
+    # serve.
+    folder = os.path.join(awfy.path, 'locks')
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Another worker was first.
+            pass
+    return util.FileLock(os.path.join(folder, prefix))
+
+# Runs a score query on a streaming cursor and yields the rows, so the
+# result set never needs to fit into memory at once. These go to the
+# replica, if there is one.
+def stream_rows(query, args):
+    c = awfy.Reader().cursor(streaming=True)
+    try:
+        c.execute(query, args)
+        for row in c:
+            yield row
+    finally:
+        c.close()
+
 def fetch_test_scores(machine_id, suite_id, name,
                       finish_stamp = (0, "UNIX_TIMESTAMP()"),
                       approx_stamp = (0, "UNIX_TIMESTAMP()")):
-    c = awfy.db.cursor()
-    query = "SELECT id FROM awfy_suite_test \
-             WHERE name = %s"
-    c.execute(query, [name])
-    suite_ids = ['0']
-    for row in c.fetchall():
-      suite_ids.append(str(row[0]))
-
-    with Profiler() as p:
-        query = "SELECT id                                                              \
-                 FROM awfy_run                                                          \
-                 WHERE status > 0                                                       \
-                 AND machine = %s                                                       \
-                 AND approx_stamp >= "+str(approx_stamp[0])+"                           \
-                 AND approx_stamp <= "+str(approx_stamp[1])+"                           \
-                 AND finish_stamp >= "+str(finish_stamp[0])+"                           \
-                 AND finish_stamp <= "+str(finish_stamp[1])+"                           \
-                 "
-        c.execute(query, [machine_id])
-        run_ids = ['0']
-        for row in c.fetchall():
-            run_ids.append(str(row[0]))
-        diff = p.time()
-    print('found ' + str(len(run_ids)) + ' rows in ' + diff)
-
-    query = "SELECT r.id, r.approx_stamp, bu.cset, s.score, bu.mode_id, v.id, s.id   \
-             FROM awfy_suite_version v                                              \
-             JOIN awfy_suite_test t ON v.id = t.suite_version_id                    \
-             JOIN awfy_breakdown s ON s.suite_test_id = t.id                        \
-             JOIN awfy_score s1 ON s.score_id = s1.id                               \
-             JOIN awfy_build bu ON s1.build_id = bu.id                                \
-		     JOIN awfy_run r ON r.id = bu.run_id                                     \
+    query = "SELECT STRAIGHT_JOIN r.id, r.approx_stamp, b.cset, s.score, b.mode_id, v.id, s.id   \
+             FROM awfy_run r                                                        \
+             JOIN awfy_build b ON r.id = b.run_id                                   \
+             JOIN awfy_score s1 ON s1.build_id = b.id                               \
+             JOIN awfy_breakdown s ON s.score_id = s1.id                            \
+             JOIN awfy_suite_test t ON t.id = s.suite_test_id                       \
+             JOIN awfy_suite_version v ON v.id = t.suite_version_id                 \
              WHERE v.suite_id = %s                                                  \
-             AND t.id in ("+(",".join(suite_ids))+")                                \
-             AND r.id in ("+(",".join(run_ids))+")                                  \
+             AND t.name = %s                                                        \
+             AND r.status > 0                                                       \
+             AND r.machine = %s                                                     \
+             AND r.approx_stamp >= "+str(approx_stamp[0])+"                         \
+             AND r.approx_stamp <= "+str(approx_stamp[1])+"                         \
+             AND r.finish_stamp >= "+str(finish_stamp[0])+"                         \
+             AND r.finish_stamp <= "+str(finish_stamp[1])+"                         \
              ORDER BY r.sort_order ASC                                              \
              "
-    c.execute(query, [suite_id])
-    return c.fetchall()
+    return stream_rows(query, [suite_id, name, machine_id])
 
 def fetch_suite_scores(machine_id, suite_id,
                        finish_stamp = (0, "UNIX_TIMESTAMP()"),
@@ -102,18 +115,43 @@ def fetch_suite_scores(machine_id, suite_id,
              AND r.finish_stamp <= "+str(finish_stamp[1])+"                         \
              ORDER BY r.sort_order ASC                                              \
              "
-    c = awfy.db.cursor()
-    c.execute(query, [suite_id, machine_id])
-    return c.fetchall()
+    return stream_rows(query, [suite_id, machine_id])
+
+# Fetches the breakdowns of all subtests of a suite in one query. Next to the
+# usual columns every row also contains the finish_stamp of the run and the
+# name of the subtest, so the caller can partition the rows per subtest.
+def fetch_suite_test_scores(machine_id, suite_id,
+                            finish_stamp = (0, "UNIX_TIMESTAMP()"),
+                            approx_stamp = (0, "UNIX_TIMESTAMP()")):
+    query = "SELECT STRAIGHT_JOIN r.id, r.approx_stamp, b.cset, s.score, b.mode_id, v.id, s.id, \
+                    r.finish_stamp, t.name                                          \
+             FROM awfy_run r                                                        \
+             JOIN awfy_build b ON r.id = b.run_id                                   \
+             JOIN awfy_score s1 ON s1.build_id = b.id                               \
+             JOIN awfy_breakdown s ON s.score_id = s1.id                            \
+             JOIN awfy_suite_test t ON t.id = s.suite_test_id                       \
+             JOIN awfy_suite_version v ON v.id = t.suite_version_id                 \
+             WHERE v.suite_id = %s                                                  \
+             AND r.status > 0                                                       \
+             AND r.machine = %s                                                     \
+             AND r.approx_stamp >= "+str(approx_stamp[0])+"                         \
+             AND r.approx_stamp <= "+str(approx_stamp[1])+"                         \
+             AND r.finish_stamp >= "+str(finish_stamp[0])+"                         \
+             AND r.finish_stamp <= "+str(finish_stamp[1])+"                         \
+             ORDER BY r.sort_order ASC                                              \
+             "
+    return stream_rows(query, [suite_id, machine_id])
 
 def delete_cache(prefix):
-    if os.path.exists(os.path.join(awfy.path, prefix + '.json')):
-        os.remove(os.path.join(awfy.path, prefix + '.json'))
+    path = catalog.path_of(prefix + '.json')
+    if os.path.exists(path):
+        os.remove(path)
+        catalog.removed(prefix + '.json')
 
 def open_cache(suite, prefix):
     try:
-        with open(os.path.join(awfy.path, prefix + '.json')) as fp:
-            cache = util.json_load(fp)
+        with open(catalog.path_of(prefix + '.json')) as fp:
+            cache = graphformat.expand(util.json_load(fp))
             return cache['graph']
     except:
         return { 'timelist': [],
@@ -121,16 +159,12 @@ def open_cache(suite, prefix):
                  'direction': suite.direction
                }
 
-def save_cache(prefix, cache):
-    j = { 'graph': cache,
-          'version': awfy.version
-        }
-    with open(os.path.join(awfy.path, prefix + '.json'), 'w') as fp:
-        util.json_dump(j, fp)
-
-def update_cache(cx, suite, prefix, when, rows):
+# Builds a graph out of rows of the score queries. Also returns the run of
+# every point, keyed by (modeid, id).
+def build_graph(cx, suite, rows):
     # Sort everything into separate modes.
     modes = { }
+    runs = { }
     for row in rows:
         modeid = int(row[4])
         if not modeid in cx.modemap:
@@ -143,6 +177,8 @@ def update_cache(cx, suite, prefix, when, rows):
             modes[modeid] = line
 
         line.append(row)
+        if row[0] is not None:
+            runs[(modeid, row[6])] = int(row[0])
 
     # Build our actual datasets.
     graph = GraphBuilder(suite.direction)
@@ -156,147 +192,272 @@ def update_cache(cx, suite, prefix, when, rows):
                           row[5],         # suite_version
                           row[6])         # id
     graph.fixup()
-    new_data = graph.output()
+    return graph.output(), runs
+
+def open_segment(suite, prefix):
+    # Caches written before the segment store existed (or in an older
+    # segment format) are imported once.
+    segment = rawstore.Segment(prefix)
+    if not segment.valid():
+        rawstore.delete(prefix)
+        cache = open_cache(suite, prefix)
+        if len(cache['timelist']):
+            segment.append(cache)
+    return segment
 
-    # Open the old cache.
-    cache = open_cache(suite, prefix)
+def update_cache(cx, suite, prefix, when, rows):
+    new_data, runs = build_graph(cx, suite, rows)
+    if not len(new_data['timelist']):
+        return True
 
-    # Build a reverse mode mapping for the cache.
-    cache_modes = { }
-    for i, oldline in enumerate(cache['lines']):
-        cache_modes[int(oldline['modeid'])] = oldline
+    segment = open_segment(suite, prefix)
 
     # Test that there are only datapoints added at the end. 
-    # Else report to fully renew cache. 
-    if len(cache['timelist']) and len(new_data['timelist']):
-        if new_data['timelist'][0] < cache['timelist'][-1]:
+    # Else report to merge or renew the cache. A retriggered run gets the
+    # timestamp of the run it follows, so a tie needs a merge too.
+    if rawstore.exists(prefix):
+        last_time = segment.last_time()
+        if last_time is not None and new_data['timelist'][0] <= last_time:
             return False
 
-    # For any of our lines that are not in the cache, prepend null points so
-    # the line width matches the existing lines.
-    for line in new_data['lines']:
-        if line['modeid'] in cache_modes:
-            continue
+    # Appending only writes the new datapoints. The condenser exports the
+    # json of the month, once it's done updating.
+    segment.append(new_data, runs)
+    manifest.bump(prefix, when)
+    return True
 
-        data = { 'data': [None] * len(cache['timelist']),
-                 'modeid': line['modeid']
-               }
-        cache['lines'].append(data)
-        cache_modes[line['modeid']] = data
-
-    # Now we can merge our data into the existing graph.
-    for line in new_data['lines']:
-        oldline = cache_modes[line['modeid']]
-        oldline['data'].extend(line['data'])
-
-    # For any lines which are in the cache, but not in our pulled data, extend
-    # them to have null datapoints for our timelist.
-    for oldline in cache['lines']:
-        modeid = int(oldline['modeid'])
-        if modeid in modes:
-            continue
-        oldline['data'].extend([None] * len(new_data['timelist']))
+def fetch_sort_orders(machine_id, when):
+    start_stamp, stop_stamp = partition.month_bounds(when)
 
-    # Finally we can extend the cache timelist.
-    cache['timelist'].extend(new_data['timelist'])
+    c = awfy.db.cursor()
+    c.execute("SELECT id, sort_order FROM awfy_run                                     \
+               WHERE machine = %s                                                      \
+               AND approx_stamp >= %s                                                  \
+               AND approx_stamp <= %s", (machine_id, start_stamp, stop_stamp))
+    sort_orders = { }
+    for row in c.fetchall():
+        sort_orders[int(row[0])] = int(row[1])
+    return sort_orders
+
+# Merges rows that belong somewhere inside an existing month into its cache,
+# instead of refetching the whole month. All points of the month get ordered
+# on the current sort_order of their run, like the query of renew_cache
+# does. Only this month gets rewritten, so only its condensed graph is out
+# of date afterwards. Returns False if the month still needs to get renewed.
+def merge_cache(cx, machine, suite, prefix, when, rows):
+    segment = open_segment(suite, prefix)
+    if not rawstore.exists(prefix):
+        return False
+
+    sort_orders = fetch_sort_orders(machine.id, when)
+
+    merged = []
+    known = set()
+    for row in segment.points():
+        if row[0] not in sort_orders:
+            return False
+        merged.append(row)
+        known.add((row[4], row[6]))
 
-    # Sanity check.
-    for line in cache['lines']:
-        if len(line['data']) != len(cache['timelist']):
-            print len(line['data']), ' != ', len(cache['timelist'])
-            raise Exception('computed datapoints wrong')
+    for row in rows:
+        if (int(row[4]), row[6]) in known:
+            continue
+        if int(row[0]) not in sort_orders:
+            return False
+        merged.append(row)
 
-    # Now save the results.
-    save_cache(prefix, cache)
+    merged.sort(key=lambda row: sort_orders[int(row[0])])
+    graph, runs = build_graph(cx, suite, merged)
+    segment.replace(graph, runs)
+    manifest.bump(prefix, when)
     return True
 
 def renew_cache(cx, machine, suite, prefix, when, fetch):
-    delete_cache(prefix + '-' + str(when[0]) + '-' + str(when[1]));
+    name = prefix + partition.month_suffix(when)
+    delete_cache(name)
+    rawstore.delete(name)
 
     # Delete corresponding condensed graph
     before, after = prefix.split("raw", 1)
-    delete_cache(before + "condensed" + after + '-' + str(when[0]) + '-' + str(when[1]));
-
-    dt = datetime.datetime(year=when[0], month=when[1], day=1)
-    start_stamp = int(time.mktime(dt.timetuple()))
+    delete_cache(before + "condensed" + after + partition.month_suffix(when))
 
-    next_month = when[1] + 1
-    next_year = when[0]
-    if next_month == 13:
-        next_month = 1
-        next_year += 1
-    dt = datetime.datetime(year=next_year, month=next_month, day=1)
-    stop_stamp = int(time.mktime(dt.timetuple())) - 1
+    # The month may not come back at all, which the condenser needs to know.
+    manifest.bump(name, when)
 
-    name = prefix + '-' + str(when[0]) + '-' + str(when[1])
+    # Same (UTC) bounds as used to partition the rows into months.
+    start_stamp, stop_stamp = partition.month_bounds(when)
 
     # Querying all information from this month.
     sys.stdout.write('Fetching monthly info ' + name + '... ')
     sys.stdout.flush()
     with Profiler() as p:
-        rows = fetch(machine, approx_stamp=(start_stamp,stop_stamp))
+        rows = list(fetch(machine, approx_stamp=(start_stamp,stop_stamp)))
         diff = p.time()
     new_rows = len(rows)
     print('found ' + str(new_rows) + ' rows in ' + diff)
 
     update_cache(cx, suite, name, when, rows) 
 
+class MonthUpdater(object):
+    """Takes the rows of one cache, in the order of the query, and writes
+    every group of rows falling in the same month to the cache as soon as the
+    group is complete. Groups that don't go at the end of their month are
+    only merged (or renewed) in finish(), once the streaming query is
+    done."""
+    def __init__(self, cx, suite, prefix):
+        self.cx = cx
+        self.suite = suite
+        self.prefix = prefix
+        self.when = None
+        self.rows = []
+        self.late = []
+        self.count = 0
+
+    def add(self, row):
+        when = partition.month_of(int(row[1]))
+        if when != self.when:
+            self.flush()
+            self.when = when
+        self.rows.append(row)
+        self.count += 1
+
+    def flush(self):
+        if not len(self.rows):
+            return
+
+        rows = self.rows
+        self.rows = []
+
+        name = self.prefix + partition.month_suffix(self.when)
+        with Profiler() as p:
+            if not update_cache(self.cx, self.suite, name, self.when, rows):
+                self.late.append((self.when, rows))
+            diff = p.time()
+        sys.stdout.write('Updating cache for ' + name + '...')
+        sys.stdout.flush()
+        print('took ' + diff)
+
+    def finish(self, machine, fetch):
+        self.flush()
+
+        renew = []
+        for when, rows in self.late:
+            if when in renew:
+                continue
+
+            name = self.prefix + partition.month_suffix(when)
+            with Profiler() as p:
+                merged = merge_cache(self.cx, machine, self.suite, name, when, rows)
+                diff = p.time()
+            if not merged:
+                renew.append(when)
+                continue
+            sys.stdout.write('Merging late datapoints into ' + name + '...')
+            sys.stdout.flush()
+            print('took ' + diff)
+
+        for when in renew:
+            renew_cache(self.cx, machine, self.suite, self.prefix, when, fetch)
+
+# The newest finish_stamp an update takes rows up to. Scores are read from the
+# replica, which can be up to replica_lag seconds behind.
+def visible_stamp():
+    return int(time.time()) - awfy.replica_lag
+
 def perform_update(cx, machine, suite, prefix, fetch):
     # Fetch the actual data.
     metadata = load_metadata(prefix)
     last_stamp = metadata['last_stamp']
-    current_stamp = int(time.time())
+    current_stamp = visible_stamp()
 
     sys.stdout.write('Querying for new rows ' + prefix + '... ')
     sys.stdout.flush()
+    updater = MonthUpdater(cx, suite, prefix)
     with Profiler() as p:
-        rows = fetch(machine, finish_stamp=(last_stamp+1, current_stamp))
+        for row in fetch(machine, finish_stamp=(last_stamp+1, current_stamp)):
+            updater.add(row)
+        updater.finish(machine, fetch)
         diff = p.time()
-    new_rows = len(rows)
+    new_rows = updater.count
     print('found ' + str(new_rows) + ' new rows in ' + diff)
-    if new_rows == 0:
-        metadata['last_stamp'] = current_stamp
-        save_metadata(prefix, metadata)
-        return 0
 
-    # Break everything into months.
-    year = 0
-    month = 0
-    current = []
-    months = []
-    for row in rows:
-        stamp = int(row[1])
-        t = time.gmtime(stamp)
-        if t.tm_year != year or t.tm_mon != month:
-            if year and len(current):
-                months.append(((year, month), current))
-            current = []
-            year = t.tm_year
-            month = t.tm_mon
+    metadata['last_stamp'] = current_stamp
+    save_metadata(prefix, metadata)
 
-        current.append(row)
+    return new_rows
 
-    if len(current):
-        months.append(((year, month), current))
+# Caches whose last_stamp is at most this many seconds behind the newest one
+# are updated by the shared query, the others one by one.
+BulkWindow = 24 * 3600
+
+# Same as perform_update, but for a set of caches which are filled by one
+# query. |prefixes| maps a key (the subtest name) to the prefix of its cache.
+# The rows returned by |fetch| have the finish_stamp and the key as the last
+# two columns. |fetch_one| gives the per-key fetch function, used to renew a
+# cache and to update the caches that are far behind the others.
+def perform_bulk_update(cx, machine, suite, prefixes, fetch, fetch_one):
+    metadatas = { }
+    for key in prefixes:
+        metadatas[key] = load_metadata(prefixes[key])
+    if not len(metadatas):
+        return 0
 
-    for when, data in months:
-        name = prefix + '-' + str(when[0]) + '-' + str(when[1])
+    # Normally all caches were updated up to the same stamp. A cache that
+    # was never updated (e.g. a subtest that got added) or that fell behind
+    # would make the shared query return the whole history of every subtest,
+    # so those catch up on their own.
+    newest = max(metadata['last_stamp'] for metadata in metadatas.values())
+    behind = [key for key in metadatas if metadatas[key]['last_stamp'] < newest - BulkWindow]
+    count = 0
+    for key in behind:
+        count += perform_update(cx, machine, suite, prefixes[key], fetch_one(key))
+        del metadatas[key]
+    if not len(metadatas):
+        return count
+
+    last_stamp = min(metadata['last_stamp'] for metadata in metadatas.values())
+    current_stamp = visible_stamp()
+
+    sys.stdout.write('Querying for new rows of ' + str(len(metadatas)) + ' caches... ')
+    sys.stdout.flush()
 
-        with Profiler() as p:
-            if not update_cache(cx, suite, name, when, data):
-                renew_cache(cx, machine, suite, prefix, when, fetch)
-            diff = p.time()
-        sys.stdout.write('Updating cache for ' + name + '...')
-        sys.stdout.flush()
-        print('took ' + diff)
+    # Partition the rows per cache. Rows which the cache already has seen
+    # (because its last_stamp is newer than the oldest one) are dropped.
+    applied = 0
+    updaters = { }
+    with Profiler() as p:
+        for row in fetch(machine, finish_stamp=(last_stamp+1, current_stamp)):
+            key = row[-1]
+            if key not in metadatas:
+                continue
+            if int(row[-2]) <= metadatas[key]['last_stamp']:
+                continue
+            if key not in updaters:
+                updaters[key] = MonthUpdater(cx, suite, prefixes[key])
+            updaters[key].add(row[:-2])
+            applied += 1
+
+        for key in updaters:
+            updaters[key].finish(machine, fetch_one(key))
+        diff = p.time()
+    print('found ' + str(applied) + ' new rows in ' + diff)
 
-    metadata['last_stamp'] = current_stamp
-    save_metadata(prefix, metadata)
+    for key in metadatas:
+        metadatas[key]['last_stamp'] = current_stamp
+        save_metadata(prefixes[key], metadatas[key])
 
-    return new_rows
+    return count + applied
 # Done
 
 def update(cx, machine, suite):
+    prefix = ""
+    if suite.visible == 2:
+        prefix = "auth-"
+
+    with partition_lock(prefix + suite.name + '-' + str(machine.id)):
+        return update_partition(cx, machine, suite)
+
+def update_partition(cx, machine, suite):
     def fetch_aggregate(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
         return fetch_suite_scores(machine.id, suite.id, finish_stamp, approx_stamp)
 
@@ -310,21 +471,29 @@ def update(cx, machine, suite):
     # This is a little cheeky, but as an optimization we don't bother querying
     # subtests if we didn't find new rows.
     if not new_rows:
-        return
+        return 0
 
-    for test_name in suite.tests:
-        def fetch_test(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
+    def fetch_tests(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
+        return fetch_suite_test_scores(machine.id, suite.id, finish_stamp, approx_stamp)
+
+    def fetch_test(test_name):
+        def fetch(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
             return fetch_test_scores(machine.id, suite.id, test_name, finish_stamp, approx_stamp)
+        return fetch
 
+    prefixes = { }
+    for test_name in suite.tests:
         prefix = ""
         if suite.visible == 2:
             prefix = "auth-"
 
-        prefix += 'bk-raw-' + suite.name + '-' + test_name + '-' + str(machine.id)
-        perform_update(cx, machine, suite, prefix, fetch_test)
+        prefixes[test_name] = prefix + 'bk-raw-' + suite.name + '-' + test_name + '-' + str(machine.id)
+    perform_bulk_update(cx, machine, suite, prefixes, fetch_tests, fetch_test)
+
+    return new_rows
 
 def export_master(cx):
-    j = { "version": awfy.version,
+    j = { "version": awfy.Version(),
           "modes": cx.exportModes(),
           "vendors": cx.exportVendors(),
           "machines": cx.exportMachines(),
@@ -349,24 +518,178 @@ def export_master(cx):
     with open(path, 'w') as fp:
         fp.write(text)
 
-def update_all(cx):
-    for machine in cx.machines:
+# The context is shared with the worker processes by forking, instead of
+# pickling it for every partition.
+worker_cx = None
+
+def init_worker():
+    # A forked worker can't share the MySQL connection of its parent.
+    awfy.db.connect()
+
+# Returns the files the update added and removed, for the catalog of the
+# parent.
+def update_worker(partition):
+    machine_index, suite_index = partition
+    machine = worker_cx.machines[machine_index]
+    suite = worker_cx.benchmarks[suite_index]
+    catalog.start_journal()
+    try:
+        update(worker_cx, machine, suite)
+    finally:
+        changes = catalog.take_journal()
+    return changes
+
+def partitions(cx, dirty = None):
+    for i, machine in enumerate(cx.machines):
         # Don't try to update machines that we're no longer tracking.
         if machine.active == 2:
             continue
 
-        for benchmark in cx.benchmarks:
-            update(cx, machine, benchmark)
+        for j, benchmark in enumerate(cx.benchmarks):
+            if dirty is not None and (machine.id, benchmark.id) not in dirty:
+                continue
+            yield (i, j)
+
+# The website queues the (machine, suite) pairs of every run that finishes.
+# Returns the pairs queued by runs which finished up to |stamp|, and the last
+# queue id read. Later runs might not have reached the replica yet, so they
+# stay queued for the next update. Without the queue (it comes with
+# database/migration-18.php) every partition of |cx| is returned, and None
+# as the last id.
+def fetch_dirty(cx, stamp):
+    c = awfy.db.cursor()
+    c.execute("SHOW TABLES LIKE 'awfy_dirty_partition'")
+    if c.fetchone() is None:
+        return set((machine.id, suite.id) for machine in cx.machines
+                                          for suite in cx.benchmarks), None
+
+    c.execute("SELECT d.id, d.machine_id, d.suite_id                    \
+               FROM awfy_dirty_partition d                              \
+               LEFT JOIN awfy_run r ON r.id = d.run_id                  \
+               WHERE r.id IS NULL OR r.finish_stamp <= %s", (stamp,))
+    dirty = set()
+    last_id = 0
+    for row in c.fetchall():
+        dirty.add((int(row[1]), int(row[2])))
+        last_id = max(last_id, int(row[0]))
+    return dirty, last_id
+
+# Removes what fetch_dirty(|stamp|) returned.
+def clear_dirty(last_id, stamp):
+    if last_id is None:
+        return
+    c = awfy.db.cursor()
+    c.execute("DELETE d FROM awfy_dirty_partition d                     \
+               LEFT JOIN awfy_run r ON r.id = d.run_id                  \
+               WHERE d.id <= %s                                         \
+               AND (r.id IS NULL OR r.finish_stamp <= %s)", (last_id, stamp))
+    awfy.db.commit()
+
+def update_all(cx, workers = 1, everything = False):
+    dirty = None
+    stamp = visible_stamp()
+    if not everything:
+        dirty, last_id = fetch_dirty(cx, stamp)
+        print('Found ' + str(len(dirty)) + ' dirty partitions')
+
+    update_partitions(cx, list(partitions(cx, dirty)), workers)
+
+    if dirty is not None:
+        clear_dirty(last_id, stamp)
+
+def update_partitions(cx, todo, workers):
+    if workers <= 1:
+        for i, j in todo:
+            update(cx, cx.machines[i], cx.benchmarks[j])
+        return
+
+    # Close our connections before forking, else a worker closing its copy
+    # would take down the connection of the parent.
+    global worker_cx
+    worker_cx = cx
+    awfy.Disconnect()
+    pool = multiprocessing.Pool(workers, init_worker)
+    try:
+        for changes in pool.map(update_worker, todo, 1):
+            catalog.replay(changes)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        worker_cx = None
+        awfy.db.connect()
+
+# Keeps the context and the database connection around between update
+# cycles. Every |interval| seconds the queue of finished runs is checked and
+# only when something got queued a cycle runs. The context is refreshed for
+# the queued partitions, or when the version, suites or machines changed.
+def run_daemon(cx, workers, interval):
+    last_signature = data.signature()
+    while True:
+        begin = time.time()
+        try:
+            # End the previous transaction, else the queue would be read from
+            # an old snapshot.
+            awfy.db.commit()
+
+            signature = data.signature()
+            stamp = visible_stamp()
+            dirty, last_id = fetch_dirty(cx, stamp)
+            changed = signature != last_signature
+            if changed or len(dirty):
+                print('Refreshing master properties...')
+                with Profiler('Refreshed master properties'):
+                    awfy.version = awfy.LoadVersion()
+                    cx.refresh(dirty)
+                last_signature = signature
+
+            if len(dirty):
+                print('Found ' + str(len(dirty)) + ' dirty partitions')
+                update_partitions(cx, list(partitions(cx, dirty)), workers)
+                clear_dirty(last_id, stamp)
+                condenser.condense_all(cx)
+
+            if changed or len(dirty):
+                export_master(cx)
+            sys.stdout.flush()
+        except KeyboardInterrupt:
+            raise
+        except:
+            # Keep running. Most likely the connection got dropped, so start
+            # over with new ones, opened on first use.
+            traceback.print_exc()
+            awfy.Disconnect()
+            # A worker that failed took what it changed with it.
+            catalog.reset()
+
+        time.sleep(max(0, interval - (time.time() - begin)))
 
 def main(argv):
-    sys.stdout.write('Computing master properties... ')
-    sys.stdout.flush()
-    with Profiler() as p:
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-j", "--workers", dest="workers", type="int", default=awfy.update_workers,
+                      help="Number of processes used to update the (machine, suite) partitions.")
+    parser.add_option("-a", "--all", dest="everything", action="store_true", default=False,
+                      help="Update all partitions instead of only the queued ones.")
+    parser.add_option("-d", "--daemon", dest="daemon", action="store_true", default=False,
+                      help="Keep running and update whenever runs got finished.")
+    parser.add_option("--interval", dest="interval", type="int", default=60,
+                      help="Seconds between two checks for finished runs in daemon mode.")
+    (options, args) = parser.parse_args(argv)
+
+    print('Computing master properties...')
+    with Profiler('Computed master properties'):
         cx = data.Context()
-        diff = p.time()
-    print('took ' + diff)
 
-    update_all(cx)
+    if options.daemon:
+        run_daemon(cx, options.workers, options.interval)
+        return
+
+    update_all(cx, options.workers, options.everything)
+    # The daemon keeps its catalog up to date, a single run lists the folder
+    # once the updates are done.
+    catalog.reset()
     condenser.condense_all(cx)
     export_master(cx)
 
@@ -3,6 +3,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import sys
+import math
+import array
+import fcntl
+
 try:
     import cjson
 except:
@@ -26,3 +31,52 @@ def json_dumps(obj):
     if cjson:
         return cjson.encode(obj)
     return json.dumps(obj)
+
+# Little-endian (de)serialization of arrays, used by the binary stores.
+def unpack_array(typecode, data):
+    arr = array.array(typecode)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+def pack_array(typecode, values):
+    arr = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
+
+# The spread of the scores of a condensed region: the lowest and highest
+# score, the median and the (population) standard deviation.
+def spread(scores):
+    ordered = sorted(scores)
+    n = len(ordered)
+    if n % 2:
+        median = ordered[n // 2]
+    else:
+        median = (ordered[n // 2 - 1] + ordered[n // 2]) / 2.0
+    mean = sum(scores) / n
+    deviation = math.sqrt(sum((score - mean) ** 2 for score in scores) / n)
+    return ordered[0], ordered[-1], median, deviation
+
+class FileLock(object):
+    """Exclusive advisory lock on the given path, held for the duration of
+    a with-block. Used to make sure only one process touches a cache."""
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+
+    def __enter__(self):
+        self.fp = open(self.path, 'a')
+        fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+        self.fp.close()
+        self.fp = None
@@ -0,0 +1,89 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import awfy
+import dense
+import partition
+import rawstore
+import condenser
+
+def random_segment(seed):
+    # A month written in a few appends, with modes that come and go, zero
+    # scores, missing csets and timestamps shared by several runs.
+    random.seed(seed)
+    segment = rawstore.Segment('raw-test-1-2015-1')
+    stamp = partition.month_bounds((2015, 1))[0]
+    for block in range(random.randint(1, 5)):
+        timelist = []
+        for i in range(random.randint(0, 300)):
+            stamp += random.choice([0, 600, 3600, 20000])
+            timelist.append(stamp)
+        lines = []
+        for modeid in random.sample([1, 2, 3, 4], random.randint(0, 3)):
+            data = []
+            for i in range(len(timelist)):
+                if random.random() < 0.3:
+                    data.append(None)
+                    continue
+                score = 0.0 if random.random() < 0.1 else random.random() * 1000
+                data.append([score, random.choice([None, '', 'a' + str(i), 'b']), None,
+                             random.choice([None, 3]), random.choice([None, random.randint(1, 99999)])])
+            lines.append({ 'modeid': modeid, 'data': data })
+        segment.append({ 'direction': 1, 'timelist': timelist, 'lines': lines })
+    return segment
+
+@unittest.skipIf(dense.numpy is None, "numpy is not installed")
+class TestDenseCondense(unittest.TestCase):
+    # The averages and deviations may differ from condense_graph() in the
+    # last bits, everything else has to be the same.
+    def assertSameGraph(self, expected, got):
+        self.assertEqual(expected['direction'], got['direction'])
+        self.assertEqual(expected['timelist'], got['timelist'])
+        self.assertEqual(len(expected['lines']), len(got['lines']))
+        for line, other in zip(expected['lines'], got['lines']):
+            self.assertEqual(line['modeid'], other['modeid'])
+            self.assertEqual(len(line['data']), len(other['data']))
+            for point, same in zip(line['data'], other['data']):
+                self.assertEqual(len(point), len(same))
+                for i, (value, other_value) in enumerate(zip(point, same)):
+                    if i in (0, 9):
+                        self.assertAlmostEqual(value, other_value, delta=1e-9 * abs(value))
+                    else:
+                        self.assertEqual(value, other_value)
+
+    def setUp(self):
+        self.path = awfy.path
+        self.shard_data = awfy.shard_data
+        awfy.path = tempfile.mkdtemp()
+        awfy.shard_data = False
+
+    def tearDown(self):
+        shutil.rmtree(awfy.path)
+        awfy.path = self.path
+        awfy.shard_data = self.shard_data
+
+    def test_same_as_condense_graph(self):
+        for seed in range(50):
+            segment = random_segment(seed)
+            graph = segment.graph()
+            regions = partition.split_into_days(graph['timelist'])
+            expected = condenser.condense_graph(graph, regions)
+            got = dense.DenseGraph.from_segment(segment).condense(regions)
+            self.assertSameGraph(expected, got)
+            rawstore.delete(segment.name)
+
+    def test_whole_and_empty_regions(self):
+        segment = random_segment(1)
+        graph = segment.graph()
+        for regions in [[(0, len(graph['timelist']))], [(0, 0)], []]:
+            expected = condenser.condense_graph(graph, regions)
+            got = dense.DenseGraph.from_segment(segment).condense(regions)
+            self.assertSameGraph(expected, got)
+
+if __name__ == '__main__':
+    unittest.main()
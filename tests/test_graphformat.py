@@ -0,0 +1,65 @@
+import os
+import sys
+import copy
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import graphformat
+
+def padded_graph():
+    return { 'direction': 1,
+             'timelist': [10, 20, 20, 30, 40],
+             'lines': [{ 'modeid': 1,
+                         'data': [[1.5, 'abc', None, 3, 100], None, None,
+                                  [2.5, 'def', 'abc', 3, 101], None] },
+                       { 'modeid': 2,
+                         'data': [None, [0.0, None, None, None, None],
+                                  [3.5, 'abc', None, 4, 102], None,
+                                  [4.5, '', None, 3, None]] },
+                       { 'modeid': 3,
+                         'data': [None, None, None, None, None] }]
+           }
+
+class TestGraphFormat(unittest.TestCase):
+    def test_round_trip(self):
+        graph = padded_graph()
+        compact = graphformat.encode(copy.deepcopy(graph))
+        self.assertEqual(graphformat.decode(compact), graph)
+
+    def test_only_points_are_stored(self):
+        compact = graphformat.encode(padded_graph())
+        self.assertEqual(compact['format'], graphformat.FormatVersion)
+        self.assertEqual([line['gaps'] for line in compact['lines']], [[0, 2], [1, 0, 1], []])
+        self.assertEqual(compact['lines'][2]['data'], [])
+
+    def test_shared_table(self):
+        compact = graphformat.encode(padded_graph())
+        # Every distinct cset and suite_version once, shared by all lines.
+        self.assertEqual(sorted(compact['table'], key=str), sorted(['abc', 'def', '', 3, 4], key=str))
+        table = compact['table']
+        self.assertEqual(table[compact['lines'][0]['data'][1][2]], 'abc')
+        self.assertEqual(compact['lines'][1]['data'][0][1], None)
+
+    def test_padded_graphs_pass_through(self):
+        graph = padded_graph()
+        self.assertEqual(graphformat.decode(graph), padded_graph())
+
+    def test_unknown_format(self):
+        compact = graphformat.encode(padded_graph())
+        compact['format'] = graphformat.FormatVersion + 1
+        self.assertRaises(Exception, graphformat.decode, compact)
+
+    def test_exports(self):
+        j = { 'version': 7,
+              'graphs': { 'a': padded_graph(), 'b': padded_graph() }
+            }
+        compact = graphformat.compact(j)
+        self.assertTrue('graphs' in j and 'format' not in j['graphs']['a'])
+        self.assertEqual(compact['graphs']['a']['format'], graphformat.FormatVersion)
+        self.assertEqual(graphformat.expand(compact), j)
+
+        j = { 'version': 7, 'graph': padded_graph() }
+        self.assertEqual(graphformat.expand(graphformat.compact(j)), j)
+
+if __name__ == '__main__':
+    unittest.main()
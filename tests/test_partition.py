@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import calendar
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import partition
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        # The bounds must not depend on the local timezone.
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/Los_Angeles'
+        time.tzset()
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def test_month_bounds(self):
+        self.assertEqual(partition.month_bounds((2015, 1)),
+                         (calendar.timegm((2015, 1, 1, 0, 0, 0)),
+                          calendar.timegm((2015, 2, 1, 0, 0, 0)) - 1))
+        start, stop = partition.month_bounds((2016, 2))
+        self.assertEqual(stop - start + 1, 29 * partition.SecondsPerDay)
+        start, stop = partition.month_bounds((2015, 12))
+        self.assertEqual(stop + 1, partition.month_bounds((2016, 1))[0])
+
+    def test_month_of_matches_bounds(self):
+        when = (2014, 1)
+        for i in range(36):
+            start, stop = partition.month_bounds(when)
+            self.assertEqual(partition.month_of(start), when)
+            self.assertEqual(partition.month_of(stop), when)
+            self.assertEqual(partition.next_month(partition.month_of(start - 1)), when)
+            self.assertEqual(partition.month_of(stop + 1), partition.next_month(when))
+            when = partition.next_month(when)
+
+    def test_next_month(self):
+        self.assertEqual(partition.next_month((2015, 11)), (2015, 12))
+        self.assertEqual(partition.next_month((2015, 12)), (2016, 1))
+
+    def test_month_suffix(self):
+        self.assertEqual(partition.month_suffix((2015, 3)), '-2015-3')
+
+    def test_split_into_days(self):
+        day = partition.SecondsPerDay
+        start = partition.month_bounds((2015, 3))[0]
+        timelist = [start, start + 10, start + day - 1, start + day, start + 3 * day, start + 3 * day]
+        self.assertEqual(partition.split_into_days(timelist), [(0, 3), (3, 4), (4, 6)])
+        self.assertEqual(partition.split_into_days([start]), [(0, 1)])
+        self.assertEqual(partition.split_into_days([]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import awfy
+import rawstore
+
+def month(timelist, lines):
+    return { 'direction': 1,
+             'timelist': timelist,
+             'lines': [{ 'modeid': modeid, 'data': data } for modeid, data in lines]
+           }
+
+first = month([100, 200, 200], [(1, [[1.5, 'a', None, 3, 11], None, [2.5, 'b', None, None, 12]]),
+                                (2, [None, [3.5, None, None, 4, 13], None])])
+second = month([300, 400], [(2, [[4.5, u'c\xe9', None, 4, 14], None]),
+                            (5, [None, [0.0, '', None, None, None]])])
+
+def both():
+    # Lines of later blocks are padded to the whole timelist, in the order
+    # their modes first appeared.
+    return month([100, 200, 200, 300, 400],
+                 [(1, first['lines'][0]['data'] + [None, None]),
+                  (2, first['lines'][1]['data'] + second['lines'][0]['data']),
+                  (5, [None] * 3 + second['lines'][1]['data'])])
+
+class TestRawStore(unittest.TestCase):
+    def setUp(self):
+        self.path = awfy.path
+        self.shard_data = awfy.shard_data
+        awfy.path = tempfile.mkdtemp()
+        awfy.shard_data = False
+
+    def tearDown(self):
+        shutil.rmtree(awfy.path)
+        awfy.path = self.path
+        awfy.shard_data = self.shard_data
+
+    def test_round_trip(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        self.assertFalse(segment.valid())
+        segment.append(first)
+        self.assertTrue(segment.valid())
+        self.assertEqual(segment.graph(), first)
+        self.assertEqual(segment.direction(), 1)
+        self.assertEqual(segment.last_time(), 200)
+
+    def test_append(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        segment.append(first)
+        segment.append(second)
+        self.assertEqual(segment.graph(), both())
+        self.assertEqual(segment.last_time(), 400)
+        self.assertEqual(len(list(segment.blocks())), 2)
+
+    def test_points(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        segment.append(first, { (1, 11): 7, (2, 13): 8 })
+        self.assertEqual(list(segment.points()),
+                         [(7, 100, 'a', 1.5, 1, 3, 11),
+                          (None, 200, 'b', 2.5, 1, None, 12),
+                          (8, 200, None, 3.5, 2, 4, 13)])
+
+    def test_replace(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        segment.append(first)
+        segment.append(second)
+        segment.replace(second)
+        self.assertEqual(segment.graph(), second)
+        self.assertEqual(len(list(segment.blocks())), 1)
+
+    def test_partial_block(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        segment.append(first)
+        segment.append(second)
+
+        # A block that wasn't written completely gets ignored, and cut off
+        # by the next append.
+        with open(segment.path, 'r+b') as fp:
+            fp.truncate(os.path.getsize(segment.path) - 3)
+        self.assertEqual(segment.graph(), first)
+        self.assertEqual(segment.last_time(), 200)
+        segment.append(second)
+        self.assertEqual(len(list(segment.blocks())), 2)
+        self.assertEqual(segment.graph(), both())
+
+    def test_delete(self):
+        segment = rawstore.Segment('raw-test-1-2015-1')
+        segment.append(first)
+        self.assertTrue(rawstore.exists('raw-test-1-2015-1'))
+        rawstore.delete('raw-test-1-2015-1')
+        self.assertFalse(rawstore.exists('raw-test-1-2015-1'))
+        self.assertFalse(segment.valid())
+
+if __name__ == '__main__':
+    unittest.main()
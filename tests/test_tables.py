@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import tables
+
+def row(id):
+    return { "id": id, "name": "row" + str(id) }
+
+def size_of(cache, id):
+    return cache.rows[id][1]
+
+def row_size():
+    cache = tables.RowCache(1 << 20)
+    cache.put(1, row(1))
+    return size_of(cache, 1)
+
+class TestRowCache(unittest.TestCase):
+    def test_eviction(self):
+        size = row_size()
+
+        # Room for three rows, least recently used goes first.
+        cache = tables.RowCache(3 * size)
+        for id in [1, 2, 3]:
+            cache.put(id, row(id))
+        self.assertEqual(cache.get(1), row(1))
+        cache.put(4, row(4))
+        self.assertTrue(2 not in cache)
+        self.assertTrue(1 in cache and 3 in cache and 4 in cache)
+        self.assertEqual(cache.size, 3 * size)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_peek_and_discard(self):
+        cache = tables.RowCache(1 << 20)
+        cache.put(1, row(1))
+        cache.put(2, row(2))
+        self.assertEqual(cache.peek(1), row(1))
+        self.assertEqual(cache.stats()["hits"], 0)
+        cache.discard(1)
+        self.assertTrue(1 not in cache)
+        self.assertEqual(cache.size, size_of(cache, 2))
+
+    def test_attach_counts(self):
+        cache = tables.RowCache(1 << 20)
+        cache.put(1, row(1))
+        before = cache.size
+        children = [object() for i in range(100)]
+        cache.attach(1, cache.peek(1), "children", children)
+        self.assertEqual(cache.size, before + tables.estimate_size(children))
+        self.assertEqual(cache.size, size_of(cache, 1))
+
+        # Replacing a field only counts the new value.
+        cache.attach(1, cache.peek(1), "children", [])
+        self.assertEqual(cache.size, before + tables.estimate_size([]))
+
+    def test_attach_evicts(self):
+        cache = tables.RowCache(2 * row_size() + 100)
+        cache.put(1, row(1))
+        cache.put(2, row(2))
+        cache.attach(2, cache.peek(2), "children", [object() for i in range(100)])
+        self.assertTrue(1 not in cache)
+        self.assertTrue(2 in cache)
+
+    def test_pending(self):
+        cache = tables.RowCache(1 << 20)
+        for id in range(tables.BATCH_SIZE + 10):
+            cache.add_pending(id)
+        cache.add_pending(20)
+
+        # Only the last BATCH_SIZE ids are kept, and handed out oldest first.
+        self.assertEqual(len(cache.pending), tables.BATCH_SIZE)
+        self.assertEqual(cache.take_pending(3), [10, 11, 12])
+        cache.put(13, row(13))
+        self.assertEqual(cache.take_pending(2), [14, 15])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import random
+import shutil
+import time
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import awfy
+import update
+import catalog
+import rawstore
+import partition
+
+class Context(object):
+    modemap = { 1: None, 2: None, 3: None }
+
+class Suite(object):
+    direction = 1
+
+class Machine(object):
+    id = 1
+
+def make_runs(seed):
+    # Runs over three months, finishing in order, with the rows of the
+    # score queries: (run, approx_stamp, cset, score, mode, suite_version,
+    # score id). Mode 4 isn't known and gets left out.
+    random.seed(seed)
+    runs = []
+    stamp = partition.month_bounds((2015, 1))[0]
+    id = 0
+    for run in range(300):
+        stamp += random.choice([3600, 20000, 40000])
+        rows = []
+        for mode in [1, 2, 3, 4]:
+            if random.random() < 0.7:
+                id += 1
+                rows.append((run + 1, stamp, 'cset' + str(run), random.random() * 100,
+                             mode, random.choice([None, 5]), id))
+        runs.append((stamp + 600, rows))
+    return runs
+
+class FailingCursor(object):
+    closed = False
+
+    def execute(self, query, args):
+        raise Exception('query failed')
+
+    def close(self):
+        self.closed = True
+
+class FailingReader(object):
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self, streaming = False):
+        self.cursors.append(FailingCursor())
+        return self.cursors[-1]
+
+class TestUpdate(unittest.TestCase):
+    def setUp(self):
+        self.saved = (awfy.path, awfy.shard_data, awfy.lazy_subtests, awfy.replica_lag,
+                      awfy.Reader, update.visible_stamp)
+        self.folders = []
+
+    def tearDown(self):
+        for folder in self.folders:
+            shutil.rmtree(folder)
+        (awfy.path, awfy.shard_data, awfy.lazy_subtests, awfy.replica_lag,
+         awfy.Reader, update.visible_stamp) = self.saved
+
+    def use_folder(self):
+        awfy.path = tempfile.mkdtemp()
+        awfy.shard_data = False
+        awfy.lazy_subtests = False
+        catalog.reset()
+        self.folders.append(awfy.path)
+
+    def months(self):
+        graphs = { }
+        for name in os.listdir(awfy.path):
+            if name.endswith('.seg'):
+                graphs[name] = rawstore.Segment(name[:-len('.seg')]).graph()
+        return graphs
+
+    def test_streaming_matches_fetchall(self):
+        runs = make_runs(1)
+        def fetch(machine, finish_stamp, approx_stamp = None):
+            for finish, rows in runs:
+                if finish_stamp[0] <= finish <= finish_stamp[1]:
+                    for row in rows:
+                        yield row
+
+        # Streamed, a few cycles apart. Every month gets appended to as soon
+        # as its rows are complete.
+        self.use_folder()
+        cycles = [runs[100][0], runs[101][0], runs[250][0], runs[-1][0]]
+        count = 0
+        for stamp in cycles:
+            update.visible_stamp = lambda stamp = stamp: stamp
+            count += update.perform_update(Context(), Machine(), Suite(), 'raw-test-1', fetch)
+        streamed = self.months()
+
+        # All rows at once, written per month.
+        self.use_folder()
+        rows = list(fetch(Machine(), (0, runs[-1][0])))
+        months = { }
+        for row in rows:
+            months.setdefault(partition.month_of(row[1]), []).append(row)
+        for when in months:
+            name = 'raw-test-1' + partition.month_suffix(when)
+            self.assertTrue(update.update_cache(Context(), Suite(), name, when, months[when]))
+        fetched = self.months()
+
+        self.assertEqual(count, len(rows))
+        self.assertEqual(len(fetched), 3)
+        self.assertEqual(streamed, fetched)
+
+    def test_out_of_order_rows_are_not_appended(self):
+        self.use_folder()
+        when = (2015, 1)
+        start = partition.month_bounds(when)[0]
+        rows = [(1, start + 100, 'a', 1.0, 1, None, 1), (2, start + 200, 'b', 2.0, 1, None, 2)]
+        self.assertTrue(update.update_cache(Context(), Suite(), 'raw-test-1-2015-1', when, rows))
+        # A row before (or at) the last point needs a merge instead.
+        late = [(3, start + 200, 'c', 3.0, 1, None, 3)]
+        self.assertFalse(update.update_cache(Context(), Suite(), 'raw-test-1-2015-1', when, late))
+        self.assertEqual(len(list(rawstore.Segment('raw-test-1-2015-1').points())), 2)
+
+    def test_replica_lag(self):
+        self.use_folder()
+        now = int(time.time())
+        runs = [(now - 2000, [(1, now - 2600, 'a', 1.0, 1, None, 1)]),
+                (now - 10, [(2, now - 600, 'b', 2.0, 1, None, 2)])]
+        def fetch(machine, finish_stamp, approx_stamp = None):
+            for finish, rows in runs:
+                if finish_stamp[0] <= finish <= finish_stamp[1]:
+                    for row in rows:
+                        yield row
+
+        # The last run might not be on the replica yet, so it's left for the
+        # next update.
+        awfy.replica_lag = 1000
+        self.assertEqual(update.perform_update(Context(), Machine(), Suite(), 'raw-test-1', fetch), 1)
+        awfy.replica_lag = 0
+        self.assertEqual(update.perform_update(Context(), Machine(), Suite(), 'raw-test-1', fetch), 1)
+
+    def test_stream_rows_closes_on_error(self):
+        # The streaming connection goes back to the pool when the query fails.
+        reader = FailingReader()
+        awfy.Reader = lambda: reader
+        rows = update.stream_rows('SELECT 1', [])
+        self.assertRaises(Exception, list, rows)
+        self.assertTrue(reader.cursors[0].closed)
+
+if __name__ == '__main__':
+    unittest.main()
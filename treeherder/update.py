@@ -125,6 +125,9 @@ class Submitter(object):
             print "Out of order is currently not supported"
             return
 
+        # Load everything that gets sent at once.
+        builds = run.eager()
+
         # Send the data.
         modes = config.modes(run.get("machine_id"))
         for mode in modes:
@@ -132,7 +135,7 @@ class Submitter(object):
             if not mode_db:
                 print "Didn't find db mode entry for", mode
                 continue
-            build = tables.Build.fromRunAndMode(run.id, mode_db.id)
+            build = first(build for build in builds if build.get("mode_id") == mode_db.id)
             if not build:
                 continue
             self.submitBuild(build)
@@ -224,3 +227,5 @@ if __name__ == '__main__':
     for run in tables.Run.where({"status": 1, "treeherder": 0}):
       submitter.submitRun(run)
 
+    print "row cache:", tables.DBTable.cache_stats()
+
@@ -92,7 +92,51 @@ AWFY.pushState = function () {
         window.location.hash = '#' + text;
 }
 
+// Turns a graph in the compact format of server/graphformat.py back into
+// one with every line padded to the length of the timelist.
+AWFY.GraphFormat = 1;
+AWFY.decodeGraph = function (blobgraph) {
+    if (!blobgraph || !blobgraph.format)
+        return blobgraph;
+
+    // Should we handle format changes better?
+    if (blobgraph.format != AWFY.GraphFormat) {
+        window.location.reload();
+        return;
+    }
+
+    var table = blobgraph.table;
+    var lines = [];
+    for (var i = 0; i < blobgraph.lines.length; i++) {
+        var blobline = blobgraph.lines[i];
+        var data = new Array(blobgraph.timelist.length);
+        for (var j = 0; j < data.length; j++)
+            data[j] = null;
+
+        var slot = 0;
+        for (var j = 0; j < blobline.data.length; j++) {
+            slot += blobline.gaps[j];
+            var point = blobline.data[j].slice();
+            for (var k = 1; k <= 3; k++) {
+                if (point[k] !== null)
+                    point[k] = table[point[k]];
+            }
+            data[slot++] = point;
+        }
+        lines.push({ modeid: blobline.modeid, data: data });
+    }
+
+    var graph = { };
+    for (var key in blobgraph) {
+        if (key != 'format' && key != 'table')
+            graph[key] = blobgraph[key];
+    }
+    graph.lines = lines;
+    return graph;
+}
+
 AWFY.loadAggregateGraph = function (blobgraph) {
+    blobgraph = this.decodeGraph(blobgraph);
     if (!blobgraph)
         return;
     var lines = [];
@@ -135,6 +179,7 @@ AWFY.loadAggregateGraph = function (blobgraph) {
                   aggregate: blobgraph.aggregate,
                   timelist: blobgraph.timelist,
                   earliest: blobgraph.earliest,
+                  months: blobgraph.months,
                   info: info
                 };
     return graph;
@@ -163,10 +208,8 @@ AWFY.displayNewGraph = function (prefix, id, domid, graph) {
         display.draw();
     }
     this.aggregate[id] = graph;
-    if (this.start && this.end) {
-        AWFY.requestZoom(display, "condensed", this.start, this.end)
-        display.zoomInfo.level = 'month';
-    }
+    if (this.start && this.end)
+        display.requestLevel(display.chooseFactor(this.start, this.end), this.start, this.end);
 }
 
 AWFY.drawLegend = function () {
@@ -306,6 +349,9 @@ AWFY.mergeJSON = function (blobs) {
             window.location.reload();
             return;
         }
+        blob.graph = this.decodeGraph(blob.graph);
+        if (!blob.graph)
+            return;
 
         for (var j = 0; j < blob.graph.lines.length; j++) {
             var blobline = blob.graph.lines[j];
@@ -412,6 +458,14 @@ AWFY.condense = function (graph, max) {
             var last = null;
             var suite_version = null
             var id = null
+            // Spread of the scores, see condense_graph in server/condenser.py.
+            // Raw points stand for a single score.
+            var scores = 0;
+            var total = 0;
+            var squares = 0;
+            var lowest = null;
+            var highest = null;
+            var singles = [];
             for (var j = start; j < pos + slice && j < oldinfo.data.length; j++) {
                 var point = oldinfo.data[j];
                 if (!point || !point[0])
@@ -426,12 +480,41 @@ AWFY.condense = function (graph, max) {
                 suite_version = point[3]
                 id = point[4]
                 count += 1;
+
+                var n = point.length > 7 ? point[7] : 1;
+                var low = point.length > 7 ? point[5] : point[0];
+                var high = point.length > 7 ? point[6] : point[0];
+                var deviation = point.length > 9 ? point[9] : 0;
+                scores += n;
+                total += n * point[0];
+                squares += n * (deviation * deviation + point[0] * point[0]);
+                lowest = lowest === null ? low : Math.min(lowest, low);
+                highest = highest === null ? high : Math.max(highest, high);
+                if (n == 1)
+                    singles.push(point[0]);
             }
 
             var score = average ? average : null;
             id = count == 1 ? id : null
             newline.data.push([timelist.length, score]);
-			newinfo.data.push([average, first, last, suite_version, id])
+            if (!count) {
+                newinfo.data.push([average, first, last, suite_version, id]);
+                continue;
+            }
+
+            // The median is only known when every point is a single score.
+            var median = null;
+            if (singles.length == scores) {
+                singles.sort(function (a, b) { return a - b; });
+                var half = Math.floor(singles.length / 2);
+                median = singles.length % 2
+                         ? singles[half]
+                         : (singles[half - 1] + singles[half]) / 2;
+            }
+            var mean = total / scores;
+            var stddev = Math.sqrt(Math.max(squares / scores - mean * mean, 0));
+			newinfo.data.push([average, first, last, suite_version, id,
+                               lowest, highest, scores, median, stddev])
         }
 
         timelist.push(graph.timelist[start]);
@@ -546,6 +629,28 @@ AWFY.requestZoom = function (display, kind, start_t, end_t) {
     this.request(files, zoom.bind(this));
 }
 
+// Estimates the number of raw datapoints between two times, from the number
+// of slots of every month that the server lists in the aggregate.
+AWFY.estimatePoints = function (months, start_t, end_t) {
+    var total = 0;
+    for (var i = 0; i < months.length; i++) {
+        var year = months[i][0];
+        var month = months[i][1];
+        var first = Date.UTC(year, month - 1, 1) / 1000;
+        var after = Date.UTC(year, month, 1) / 1000;
+        var overlap = Math.min(end_t, after) - Math.max(start_t, first);
+        if (overlap > 0)
+            total += months[i][2] * overlap / (after - first);
+    }
+    return total;
+}
+
+AWFY.levelName = function (factor) {
+    if (factor == 1)
+        return 'raw';
+    return 'lod' + factor;
+}
+
 AWFY.trackZoom = function (start, end) {
     // Only track in single modus
     if (this.view != 'single')
@@ -41,8 +41,10 @@ Display.prototype.setup = function (graph)
         this.aggregate = -1;
 
     this.zoomInfo = { prev: null,
-                      level: 'aggregate'
+                      level: 'aggregate',
+                      factor: null
                     };
+    this.zoomInfo.shown = this.zoomState();
 
     this.elt.bind("plothover", this.onHover.bind(this));
     this.elt.bind('plotclick', this.onClick.bind(this));
@@ -54,6 +56,10 @@ Display.prototype.setup = function (graph)
 }
 
 Display.MaxPoints = 50;
+
+// Reduction factors of the levels the server builds for every month,
+// coarsest first. Factor 1 is the raw month.
+Display.Factors = [64, 16, 4, 1];
 Display.Months = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'];
 
 Display.prototype.shutdown = function () {
@@ -326,7 +332,7 @@ Display.prototype.plotSelected = function (event, ranges) {
     AWFY.trackZoom(start, end);
 
     var prev = this.zoomInfo.prev;
-    if (prev && this.zoomInfo.level == 'month') {
+    if (prev && this.zoomInfo.level == 'lod') {
         // Estimate the number of datapoints we had in the old range.
         var oldstart = AWFY.findX(prev, this.graph.timelist[0]);
         var oldend = AWFY.findX(prev, this.graph.timelist[this.graph.timelist.length - 1]);
@@ -335,53 +341,81 @@ Display.prototype.plotSelected = function (event, ranges) {
         var newstart = AWFY.findX(prev, start);
         var newend = AWFY.findX(prev, end);
 
-        // Some heuristics to figure out whether we should fetch more data.
-        var zoom = (newend - newstart) / (oldend - oldstart);
-        if ((zoom >= 0.8 && (newend - newstart >= Display.MaxPoints * 1.5)) ||
-            (newend - newstart >= Display.MaxPoints * 5))
-        {
-            // Okay! Trim the cached graph, then display.
+        if (this.zoomInfo.factor > 1) {
+            // Some heuristics to figure out whether we should fetch more data.
+            var zoom = (newend - newstart) / (oldend - oldstart);
+            if ((zoom >= 0.8 && (newend - newstart >= Display.MaxPoints * 1.5)) ||
+                (newend - newstart >= Display.MaxPoints * 5))
+            {
+                // Okay! Trim the cached graph, then display.
+                var graph = AWFY.trim(prev, newstart, newend);
+                this.localZoom(graph);
+                return;
+            }
+        } else {
+            // If we already have the highest level of data, jump right in.
+            this.plot.clearSelection();
+
+            // If we can't really zoom in any more, don't bother.
+            if (oldend - oldstart < Display.MaxPoints / 2)
+                return;
+
+            // Require at least a few datapoints.
+            if (oldend - oldstart <= 3)
+                return;
+
             var graph = AWFY.trim(prev, newstart, newend);
             this.localZoom(graph);
             return;
         }
     }
 
-    // If we already have the highest level of data, jump right in.
-    if (prev && this.zoomInfo.level == 'raw') {
-        var oldstart = AWFY.findX(prev, this.graph.timelist[0]);
-        var oldend = AWFY.findX(prev, this.graph.timelist[this.graph.timelist.length - 1]);
-
-        this.plot.clearSelection();
+    // Disable further selections since we wait for the XHR to go through.
+    this.plot.disableSelection();
 
-        // If we can't really zoom in any more, don't bother.
-        if (oldend - oldstart < Display.MaxPoints / 2)
-            return;
+    // Fetch the coarsest level with enough points for the new range, but at
+    // least a finer one than we have.
+    var factor = this.chooseFactor(start, end);
+    if (this.zoomInfo.level == 'lod' && factor >= this.zoomInfo.factor)
+        factor = Display.finerFactor(this.zoomInfo.factor);
+    this.requestLevel(factor, start, end);
+}
 
-        // Require at least a few datapoints.
-        var newstart = AWFY.findX(prev, start);
-        var newend = AWFY.findX(prev, end);
-        if (oldend - oldstart <= 3)
-            return;
+Display.finerFactor = function (factor) {
+    var i = Display.Factors.indexOf(factor);
+    if (i < 0 || i == Display.Factors.length - 1)
+        return 1;
+    return Display.Factors[i + 1];
+}
 
-        var graph = AWFY.trim(prev, newstart, newend);
-        this.localZoom(graph);
-        return;
+// Picks the coarsest level of which the range still has Display.MaxPoints
+// points, going by the number of raw points per month in the aggregate.
+Display.prototype.chooseFactor = function (start, end) {
+    var aggregate = AWFY.aggregate[this.id];
+    if (!aggregate || !aggregate.months)
+        return 1;
+
+    var points = AWFY.estimatePoints(aggregate.months, start, end);
+    for (var i = 0; i < Display.Factors.length; i++) {
+        if (points / Display.Factors[i] >= Display.MaxPoints)
+            return Display.Factors[i];
     }
+    return 1;
+}
 
-    // Disable further selections since we wait for the XHR to go through.
-    this.plot.disableSelection();
-
+Display.prototype.requestLevel = function (factor, start, end) {
     // Clear the cached graph, since we'll get a new one.
     this.zoomInfo.prev = null;
+    this.zoomInfo.level = 'lod';
+    this.zoomInfo.factor = factor;
+    this.awfy.requestZoom(this, AWFY.levelName(factor), start, end);
+}
 
-    if (this.zoomInfo.level == 'aggregate') {
-        this.awfy.requestZoom(this, 'condensed', start, end);
-        this.zoomInfo.level = 'month';
-    } else {
-        this.awfy.requestZoom(this, 'raw', start, end);
-        this.zoomInfo.level = 'raw';
-    }
+Display.prototype.zoomState = function () {
+    return { level: this.zoomInfo.level,
+             factor: this.zoomInfo.factor,
+             prev: this.zoomInfo.prev
+           };
 }
 
 Display.prototype.localZoom = function (graph) {
@@ -391,6 +425,7 @@ Display.prototype.localZoom = function (graph) {
     this.plot.enableSelection();
     this.plot.clearSelection();
     this.detachTips();
+    this.zoomInfo.shown = this.zoomState();
 }
 
 Display.prototype.completeZoom = function (graph, start, end) {
@@ -407,10 +442,8 @@ Display.prototype.completeZoom = function (graph, start, end) {
     graph = AWFY.trim(graph, first, last);
 
     // If we got a paltry number of datapoints, skip this and zoom in more.
-    if (this.zoomInfo.level == 'month' && graph.timelist.length < Display.MaxPoints / 2) {
-        this.zoomInfo.prev = null;
-        this.awfy.requestZoom(this, 'raw', start, end);
-        this.zoomInfo.level = 'raw';
+    if (this.zoomInfo.factor > 1 && graph.timelist.length < Display.MaxPoints / 2) {
+        this.requestLevel(Display.finerFactor(this.zoomInfo.factor), start, end);
         return;
     }
 
@@ -421,13 +454,10 @@ Display.prototype.cancelZoom = function () {
     this.plot.enableSelection();
     this.plot.clearSelection();
 
-    // Reset the zoom level we think we have.
-    if (!this.zoomInfo.prev) {
-        if (this.zoomInfo.level == 'raw')
-            this.zoomInfo.level = 'month';
-        else if (this.zoomInfo.level == 'month')
-            this.zoomInfo.level = 'aggregate';
-    }
+    // Go back to the level of the graph that's still shown.
+    this.zoomInfo.level = this.zoomInfo.shown.level;
+    this.zoomInfo.factor = this.zoomInfo.shown.factor;
+    this.zoomInfo.prev = this.zoomInfo.shown.prev;
 }
 
 Display.prototype.unzoom = function () {
@@ -438,6 +468,9 @@ Display.prototype.unzoom = function () {
     this.plot.clearSelection();
     this.detachTips();
     this.zoomInfo.level = 'aggregate';
+    this.zoomInfo.factor = null;
+    this.zoomInfo.prev = null;
+    this.zoomInfo.shown = this.zoomState();
 
     AWFY.trackZoom(null, null);
 }
@@ -468,10 +501,24 @@ Display.prototype.createToolTip = function (item, extended) {
     }
 
     // Show score.
-    if (this.graph.direction == -1)
-         text += so + 'score: ' + sc + y.toFixed(2) + 'ms<br>';
-    else
-         text += so + 'score: ' + sc + y.toFixed() + '<br>';
+    var direction = this.graph.direction;
+    var format = function (score) {
+        if (direction == -1)
+            return score.toFixed(2) + 'ms';
+        return score.toFixed();
+    }
+    text += so + 'score: ' + sc + format(y) + '<br>';
+
+    // Show the spread of the scores of condensed points.
+    var stats = line.data[x];
+    if (stats && stats.length > 7 && stats[7] > 1) {
+        text += so + 'runs: ' + sc + stats[7] + '<br>';
+        text += so + 'range: ' + sc + format(stats[5]) + ' to ' + format(stats[6]) + '<br>';
+        if (stats.length > 8 && stats[8] !== null)
+            text += so + 'median: ' + sc + format(stats[8]) + '<br>';
+        if (stats.length > 9 && stats[9] !== null)
+            text += so + 'stddev: ' + sc + format(stats[9]) + '<br>';
+    }
 
     // Find the point previous to this one.
     var prev = null;
@@ -15,6 +15,7 @@ class Config {
 
     // General Config
     public $data_folder;
+    public $graph_service;
 
     function __construct($config_file_path)
     {
@@ -31,6 +32,8 @@ class Config {
         $this->mysql_db_name  = $config_array["mysql"]["db_name"];
         $this->data_folder    = $config_array["general"]["data_folder"];
         $this->slack_webhook  = $config_array["general"]["slack_webhook"];
+        $this->graph_service  = isset($config_array["general"]["graph_service"])
+                              ? $config_array["general"]["graph_service"] : "";
     }
 }
 
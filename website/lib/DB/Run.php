@@ -72,6 +72,36 @@ class Run extends DB {
                          finish_stamp = UNIX_TIMESTAMP()
                      WHERE id = {$this->id}")
             or die("ERROR: " . mysql_error());
+
+        // Remember which suites this machine reports.
+        mysql_query("INSERT INTO awfy_machine_suite
+                     (machine_id, suite_version_id, first_seen, last_seen)
+                     SELECT DISTINCT awfy_run.machine, awfy_score.suite_version_id,
+                            awfy_run.approx_stamp, awfy_run.approx_stamp
+                     FROM awfy_run
+                     JOIN awfy_build ON awfy_build.run_id = awfy_run.id
+                     JOIN awfy_score ON awfy_score.build_id = awfy_build.id
+                     WHERE awfy_run.id = {$this->id} AND
+                           awfy_score.suite_version_id IS NOT NULL
+                     ON DUPLICATE KEY UPDATE
+                         first_seen = LEAST(first_seen, VALUES(first_seen)),
+                         last_seen = GREATEST(last_seen, VALUES(last_seen))")
+            or die("ERROR: " . mysql_error());
+
+        // The scores of this run are visible from now on. Queue the
+        // (machine, suite) partitions it touched, so server/update.py
+        // only needs to look at those.
+        if ($status > 0) {
+            mysql_query("INSERT INTO awfy_dirty_partition
+                         (machine_id, suite_id, run_id)
+                         SELECT DISTINCT awfy_run.machine, awfy_suite_version.suite_id, awfy_run.id
+                         FROM awfy_run
+                         JOIN awfy_build ON awfy_build.run_id = awfy_run.id
+                         JOIN awfy_score ON awfy_score.build_id = awfy_build.id
+                         JOIN awfy_suite_version ON awfy_suite_version.id = awfy_score.suite_version_id
+                         WHERE awfy_run.id = {$this->id}")
+                or die("ERROR: " . mysql_error());
+        }
     }
 
     public function isFinished() {
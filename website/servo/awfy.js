@@ -81,7 +81,51 @@ AWFY.pushState = function () {
         window.location.hash = '#' + text;
 }
 
+// Turns a graph in the compact format of server/graphformat.py back into
+// one with every line padded to the length of the timelist.
+AWFY.GraphFormat = 1;
+AWFY.decodeGraph = function (blobgraph) {
+    if (!blobgraph || !blobgraph.format)
+        return blobgraph;
+
+    // Should we handle format changes better?
+    if (blobgraph.format != AWFY.GraphFormat) {
+        window.location.reload();
+        return;
+    }
+
+    var table = blobgraph.table;
+    var lines = [];
+    for (var i = 0; i < blobgraph.lines.length; i++) {
+        var blobline = blobgraph.lines[i];
+        var data = new Array(blobgraph.timelist.length);
+        for (var j = 0; j < data.length; j++)
+            data[j] = null;
+
+        var slot = 0;
+        for (var j = 0; j < blobline.data.length; j++) {
+            slot += blobline.gaps[j];
+            var point = blobline.data[j].slice();
+            for (var k = 1; k <= 3; k++) {
+                if (point[k] !== null)
+                    point[k] = table[point[k]];
+            }
+            data[slot++] = point;
+        }
+        lines.push({ modeid: blobline.modeid, data: data });
+    }
+
+    var graph = { };
+    for (var key in blobgraph) {
+        if (key != 'format' && key != 'table')
+            graph[key] = blobgraph[key];
+    }
+    graph.lines = lines;
+    return graph;
+}
+
 AWFY.loadAggregateGraph = function (blobgraph) {
+    blobgraph = this.decodeGraph(blobgraph);
     if (!blobgraph)
         return;
     var lines = [];
@@ -282,6 +326,9 @@ AWFY.mergeJSON = function (blobs) {
             window.location.reload();
             return;
         }
+        blob.graph = this.decodeGraph(blob.graph);
+        if (!blob.graph)
+            return;
 
         for (var j = 0; j < blob.graph.lines.length; j++) {
             var blobline = blob.graph.lines[j];